@@ -1,13 +1,52 @@
 import streamlit as st
-import streamlit.components.v1 as components
 import pandas as pd
-import tempfile
+import numpy as np
 import os
-import base64
-from pdf_processor import process_pdf_to_dataframe
-from csv_processor import process_csv_to_dataframe
-from data_merger import merge_stock_data
+import time
+from datetime import date
+from pdf_processor import extraction_tag, DEFAULT_BACKEND as PDF_DEFAULT_BACKEND, PARSER_VERSION as PDF_PARSER_VERSION
+from csv_processor import (process_csv_against_codes, process_csv_files_against_codes,
+                           PARSER_VERSION as CSV_PARSER_VERSION)
+from data_merger import RobotIndex
+from pipeline import read_robot_csvs, read_sifarma_pdf, reconcile
 from pdf_exporter import generate_pdf
+from excel_exporter import generate_excel
+from parse_cache import ParseCache
+from page_cache import PageCache
+from result_store import ResultStore
+from compact_frames import compact_frame, expand_frame
+from snapshot import SnapshotStore, compute_delta, changed_rows
+from report_jobs import ReportJobs
+from history import HistoryDB
+from instrumentation import add_records, collect, configure_logging, enable_memory_tracking, stage
+
+# Optional directory for the persistent (Parquet) tier of the parse cache
+PARSE_CACHE_DIR = os.environ.get("ROBOT_PARSE_CACHE_DIR")
+# Memory budget (MB) of the store of parsed files and merged results shared by all sessions
+RESULT_STORE_MB = int(os.environ.get("ROBOT_RESULT_STORE_MB", "512"))
+# Worker processes used to extract PDF pages (1 = sequential)
+PDF_WORKERS = int(os.environ.get("ROBOT_PDF_WORKERS", "1"))
+# PDF text extraction engine ('pdfplumber' or 'pdfium', see pdf_processor.BACKENDS)
+PDF_BACKEND = os.environ.get("ROBOT_PDF_BACKEND", PDF_DEFAULT_BACKEND)
+# Classify the PDF lines by position inside the table band (1) instead of keyword filters on
+# the whole page text (0); slower, see pdf_processor.iter_pdf_rows
+PDF_LAYOUT = os.environ.get("ROBOT_PDF_LAYOUT", "0") == "1"
+# Parsed PDF pages kept by content hash, so a re-exported list only has its changed pages parsed (0 = off)
+PAGE_CACHE_PAGES = int(os.environ.get("ROBOT_PAGE_CACHE_PAGES", "5000"))
+# Rows per chunk when aggregating robot CSVs (0 = read the whole file at once)
+CSV_CHUNKSIZE = int(os.environ.get("ROBOT_CSV_CHUNKSIZE", "0")) or None
+# Worker processes reading several robot CSVs uploaded together (0 = one per file)
+CSV_WORKERS = int(os.environ.get("ROBOT_CSV_WORKERS", "0")) or None
+# Optional directory where each run is kept, to show the changes since the previous one
+SNAPSHOT_DIR = os.environ.get("ROBOT_SNAPSHOT_DIR")
+# Background threads generating the PDF/Excel reports, and seconds between progress updates
+REPORT_WORKERS = int(os.environ.get("ROBOT_REPORT_WORKERS", "2"))
+REPORT_POLL_SECONDS = 0.5
+# Optional SQLite file where every analysis is recorded, for the trends of the 'Histórico' tab
+HISTORY_DB = os.environ.get("ROBOT_HISTORY_DB")
+# Trace memory (tracemalloc) for the per-stage peaks. Tracing is one switch for the whole
+# process, so it is a server setting rather than a per-session option
+TRACK_MEMORY = os.environ.get("ROBOT_TRACK_MEMORY", "0") == "1"
 
 # --- UI STYLE ---
 def apply_custom_style():
@@ -84,28 +123,372 @@ def apply_custom_style():
     <div class="credit">App Desenvolvida por Filipe Oliveira</div>
     """, unsafe_allow_html=True)
 
-def highlight_errors(row):
+# Column settings of the analysis grid; the browser renders the 'Divergente' flag itself
+GRID_COLUMNS = {
+    "Divergente": st.column_config.CheckboxColumn(
+        "Divergente", help="Stock Sifarma diferente do stock no Robot.", pinned=True
+    ),
+    "Ord.": st.column_config.NumberColumn("Ord.", format="%d"),
+    "Codigo": st.column_config.TextColumn("Código"),
+    "Designacao": st.column_config.TextColumn("Designação", width="large"),
+    "Stock errado": st.column_config.TextColumn("Stock errado", width="medium"),
+}
+
+def divergence_mask(df):
+    """Rows whose Sifarma and robot stocks differ (a non-empty 'Stock errado'), for compact or expanded analyses."""
+    return (df['Stock'] != df['Stock Robot']).to_numpy()
+
+def filter_analysis(df, divergent_only=False, expiring_months=None, search=""):
+    """
+    Rows of the analysis kept by the grid filters. Applied to the compact frame, so only
+    the selected rows are expanded and sent to the browser.
+
+    Args:
+        df (pd.DataFrame): Analysis (compact or expanded).
+        divergent_only (bool): Keep only rows with a stock divergence.
+        expiring_months (int): Keep only rows with a Sifarma or robot validity up to that
+                               many months from the current month (None = no filter).
+        search (str): Case-insensitive text to find in 'Designacao'.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    if divergent_only:
+        mask &= divergence_mask(df)
+    if expiring_months is not None:
+        limit = pd.Period(date.today(), 'M') + int(expiring_months)
+        expiring = np.zeros(len(df), dtype=bool)
+        for column in ('Validade Sifarma', 'Validade Real'):
+            if column in df.columns:
+                periods = df[column]
+                if not isinstance(periods.dtype, pd.PeriodDtype):
+                    periods = pd.to_datetime(periods, format='%m-%Y', errors='coerce').dt.to_period('M')
+                # Missing validities compare as False
+                expiring |= (periods <= limit).to_numpy()
+        mask &= expiring
+    if search:
+        mask &= df['Designacao'].str.contains(search, case=False, regex=False, na=False).to_numpy()
+    return df if mask.all() else df[mask]
+
+@st.cache_resource
+def get_result_store():
+    """
+    Parsed files and merged results, shared by all sessions of this Streamlit server.
+    Only the memory budget bounds it: an entry cap would make concurrent stores evict
+    each other's parses long before the budget is used.
+    """
+    return ResultStore(max_bytes=RESULT_STORE_MB * 1024 * 1024)
+
+@st.cache_resource
+def get_parse_cache():
+    """Parse cache shared by all sessions of this Streamlit server (memory tier: the result store)."""
+    return ParseCache(disk_dir=PARSE_CACHE_DIR, store=get_result_store())
+
+@st.cache_resource
+def get_page_cache():
+    """Parsed PDF pages shared by all sessions of this Streamlit server (None when disabled)."""
+    return PageCache(max_pages=PAGE_CACHE_PAGES) if PAGE_CACHE_PAGES > 0 else None
+
+def load_pdf(data):
+    return compact_frame(read_sifarma_pdf(data, workers=PDF_WORKERS, backend=PDF_BACKEND, layout=PDF_LAYOUT,
+                                          page_cache=get_page_cache()))
+
+def load_csv(datas):
+    return compact_frame(read_robot_csvs(datas, chunksize=CSV_CHUNKSIZE, workers=CSV_WORKERS))
+
+def combined_csv_key(parse_cache, datas):
+    """
+    Cache key of the robot data of one or more CSVs uploaded together: the parse key of
+    a single file, or a key over the sorted file keys (the combination does not depend on
+    the upload order).
+    """
+    keys = sorted(parse_cache.make_key('csv', data, CSV_PARSER_VERSION) for data in datas)
+    if len(keys) == 1:
+        return keys[0]
+    return parse_cache.make_key('csvs', "\n".join(keys).encode(), CSV_PARSER_VERSION)
+
+def filtered_csv_key(csv_key, pdf_key):
+    """Cache key of a robot CSV read only for the codes of a Sifarma PDF."""
+    return f"{csv_key}-for-{pdf_key}"
+
+def robot_only_key(filtered_key):
+    return f"{filtered_key}-robot-only"
+
+def load_csv_for_codes(datas, df_pdf, key):
     """
-    Highlights the row in reddish color if stock sifarma != stock robot.
-    We check the 'Stock errado' column which is populated if there is a difference.
+    Reads the CSVs keeping only the barcodes of the PDF list; the robot-only report
+    from the same pass is cached next to it.
     """
-    # If "Stock errado" has content, it means there is an error
-    if row['Stock errado']:
-        return ['background-color: rgba(255, 50, 50, 0.2)'] * len(row)
+    codes = expand_frame(df_pdf)['Código']
+    if len(datas) == 1:
+        matched, robot_only = process_csv_against_codes(datas[0], codes, chunksize=CSV_CHUNKSIZE)
     else:
-        return [''] * len(row)
+        matched, robot_only = process_csv_files_against_codes(datas, codes, chunksize=CSV_CHUNKSIZE,
+                                                              workers=CSV_WORKERS)
+    get_parse_cache().put(robot_only_key(key), robot_only)
+    return compact_frame(matched)
+
+def merge_key(pdf_key, csv_key):
+    """Store key of the analysis of a PDF/CSV pair (the parse keys already carry the parser versions)."""
+    return f"merge-{pdf_key}-{csv_key}"
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def get_robot_index(csv_key, _df_csv):
+    """Join index of a robot file, built once and reused by every merge against it."""
+    return RobotIndex(expand_frame(_df_csv))
+
+def compute_analysis(df_pdf, robot_index):
+    """Merged analysis in the original PDF order, in compact form."""
+    return compact_frame(reconcile(expand_frame(df_pdf), robot_index))
+
+@st.cache_resource
+def get_snapshot_store():
+    """Run snapshots (None when ROBOT_SNAPSHOT_DIR is not set)."""
+    return SnapshotStore(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+
+def render_changes(snapshots, store_name, analysis_df):
+    """Saves this run's snapshot and shows what changed since the previous run of the store."""
+    pdf_key, csv_key = st.session_state.pdf_key, st.session_state.csv_key
+    pdf_content_key = st.session_state.pdf_content_key
+    df_pdf = get_parse_cache().get(pdf_key)
+    df_csv = get_parse_cache().get(csv_key)
+    if df_pdf is None or df_csv is None:
+        return
+
+    # Runs are identified by the files' content, whether or not the CSV was read only for the
+    # list's codes (which gives the same robot values for every listed code)
+    content_key = st.session_state.csv_content_key
+    previous = snapshots.previous(store_name, pdf_content_key, content_key)
+    snapshots.save(store_name, pdf_content_key, content_key, df_pdf, df_csv, analysis_df)
+    if previous is None:
+        st.caption(f"Primeira execução guardada para a loja '{store_name}'; as alterações aparecem a partir da próxima.")
+        return
+
+    def compute():
+        before = snapshots.load(store_name, previous['run_id'])
+        robot_index = get_robot_index(csv_key, df_csv)
+        delta = compute_delta(before, expand_frame(df_pdf), robot_index)
+        return changed_rows(delta, expand_frame(analysis_df), before['merged'])
+
+    changes_key = f"changes-{previous['run_id']}-{merge_key(pdf_key, csv_key)}"
+    changes = get_result_store().get_or_compute(changes_key, compute)
+
+    with st.expander(f"Alterações desde a última execução ({len(changes)})", expanded=True):
+        st.caption(f"Comparado com a execução de {previous['created'].replace('T', ' ')} (loja '{store_name}').")
+        counts = changes['Alteração'].value_counts(sort=False)
+        columns = st.columns(len(counts.index))
+        for column, (change, n) in zip(columns, counts.items()):
+            column.metric(str(change).capitalize(), int(n))
+        if len(changes):
+            st.dataframe(changes, width='stretch', hide_index=True)
+        else:
+            st.caption("Sem alterações.")
+
+@st.cache_resource
+def get_history_db():
+    """Run history (None when ROBOT_HISTORY_DB is not set)."""
+    return HistoryDB(HISTORY_DB) if HISTORY_DB else None
+
+def record_history(db, store_name, compact_df):
+    """Adds this analysis to the history, once per store and pair of files."""
+    # The CSV content key, so turning the list filter on or off does not record the files again
+    pdf_key, csv_key = st.session_state.pdf_content_key, st.session_state.csv_content_key
+    if db.has_run(store_name, pdf_key, csv_key):
+        return
+    with stage('history_insert', rows_in=len(compact_df)):
+        db.record_run(store_name, date.today(), expand_frame(compact_df), pdf_key, csv_key)
+
+def render_history(db):
+    """'Histórico' tab: products chronically out of the robot, one product's history and the monthly trend."""
+    st.title("Histórico")
+    stores = db.stores()
+    if not stores:
+        st.info("Ainda não há execuções registadas.")
+        return
+
+    store_name = st.selectbox("Loja", ["Todas"] + stores, key='history_store')
+    store_name = None if store_name == "Todas" else store_name
+
+    st.subheader("Produtos cronicamente fora do Robot")
+    col1, col2 = st.columns(2)
+    min_runs = col1.number_input("Mínimo de execuções fora do Robot", min_value=1, value=2, step=1)
+    since = col2.date_input("Desde", value=None, help="Vazio = todo o histórico (mais rápido).")
+    start = time.perf_counter()
+    chronic = db.chronic_missing(store_name, since=since, min_runs=int(min_runs))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    st.dataframe(chronic, width='stretch', hide_index=True)
+    st.caption(f"{len(chronic)} produtos · consulta em {elapsed_ms:.0f} ms")
+
+    st.subheader("Histórico de um produto")
+    code = st.text_input("Código", key='history_code')
+    if code:
+        product = db.product_history(code, store_name)
+        if product.empty:
+            st.caption("Sem registos para este código.")
+        else:
+            st.line_chart(product, x='Data', y=['Stock', 'Stock Robot'])
+            st.dataframe(product, width='stretch', hide_index=True)
+
+    st.subheader("Evolução mensal")
+    trend = db.monthly_trend(store_name)
+    st.bar_chart(trend, x='Mes', y=['fora_do_robot', 'stock_em_excesso'])
+    st.dataframe(trend, width='stretch', hide_index=True)
+
+# Report formats: button label, file name and MIME type
+REPORTS = {
+    'pdf': ("🖨️ Gerar PDF", "relatorio_stock.pdf", "application/pdf"),
+    'xlsx': ("📥 Gerar Excel", "analise_stock_robot.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+@st.cache_resource
+def get_report_jobs():
+    """Report generation pool, shared by all sessions (finished reports are kept by analysis key)."""
+    return ReportJobs(max_workers=REPORT_WORKERS)
+
+def report_key(kind, analysis_key):
+    return f"{kind}-{analysis_key}"
+
+def start_report(kind, analysis_key, compact_df):
+    """Submits the generation of one report of the analysis (or returns the job already running/done)."""
+    def generate(progress):
+        df = expand_frame(compact_df)
+        if kind == 'pdf':
+            return generate_pdf(df, progress=progress).getvalue()
+        return generate_excel(df, progress=progress).getvalue()
+
+    return get_report_jobs().submit(report_key(kind, analysis_key), generate)
+
+def render_reports(analysis_key, compact_df, polling):
+    """Generate, progress and download buttons of each report format."""
+    jobs = get_report_jobs()
+    running = False
+    for column, (kind, (label, file_name, mime)) in zip(st.columns(len(REPORTS)), REPORTS.items()):
+        job = jobs.get(report_key(kind, analysis_key))
+        with column:
+            if job is None or job.failed:
+                if job is not None:
+                    st.error(f"Erro ao gerar {file_name}: {job.future.exception()}")
+                if st.button(label, key=f'report-{kind}', width='stretch'):
+                    start_report(kind, analysis_key, compact_df)
+                    # Full rerun, so the panel is drawn again with polling on
+                    st.rerun()
+            elif not job.done:
+                running = True
+                st.progress(job.progress, text=f"A gerar {file_name}... {job.progress:.0%}")
+            else:
+                # The export stages ran in a pool thread: show them in this run's performance panel
+                add_records(job.records)
+                st.download_button(
+                    label=f"⬇️ Descarregar {file_name}",
+                    data=job.result(),
+                    file_name=file_name,
+                    mime=mime,
+                    key=f'download-{kind}',
+                    on_click='ignore',
+                    width='stretch'
+                )
+    if polling and not running:
+        # Every report is ready: stop polling
+        st.rerun()
+
+def render_reports_panel(analysis_key, compact_df):
+    """Report panel, rerun on its own every REPORT_POLL_SECONDS while one of its reports is being generated."""
+    jobs = get_report_jobs()
+    polling = any(
+        job is not None and not job.done
+        for job in (jobs.get(report_key(kind, analysis_key)) for kind in REPORTS)
+    )
+    panel = st.fragment(render_reports, run_every=REPORT_POLL_SECONDS if polling else None)
+    panel(analysis_key, compact_df, polling)
+
+def render_performance_panel(records):
+    """Sidebar panel with the latest measurement of each pipeline stage."""
+    latest = st.session_state.setdefault('perf_records', {})
+    for record in records:
+        latest[record['stage']] = record
+
+    with st.sidebar.expander("Desempenho", expanded=False):
+        if not latest:
+            st.caption("Ainda sem medições.")
+            return
+        perf_df = pd.DataFrame([
+            {
+                "Etapa": r['stage'],
+                "Tempo (s)": r['wall_s'],
+                "Linhas entrada": r.get('rows_in'),
+                "Linhas saída": r.get('rows_out'),
+                "Páginas": r.get('pages'),
+                "Páginas em cache": r.get('pages_cached'),
+                "Pico memória do processo (MB)": r.get('peak_mb'),
+            }
+            for r in latest.values()
+        ])
+        st.dataframe(perf_df, hide_index=True, width='stretch')
+        if TRACK_MEMORY:
+            st.caption("O pico de memória é medido no processo inteiro: inclui o que outras sessões "
+                       "processaram ao mesmo tempo que a etapa.")
+        else:
+            st.caption("Pico de memória desligado (ative com `ROBOT_TRACK_MEMORY=1` ao iniciar o servidor).")
+        store = get_result_store().stats()
+        st.caption(
+            f"Cache partilhada: {store['entries']} resultados, {store['bytes'] / 1024 / 1024:.1f} de "
+            f"{store['max_bytes'] / 1024 / 1024:.0f} MB · {store['hits']} acertos, {store['misses']} falhas, "
+            f"{store['evictions']} remoções"
+        )
+        pages = get_page_cache()
+        if pages is not None:
+            pages = pages.stats()
+            st.caption(f"Cache de páginas PDF: {pages['pages']} de {pages['max_pages']} páginas · "
+                       f"{pages['hits']} acertos, {pages['misses']} falhas")
+        st.caption("Cada etapa é também registada como uma linha JSON no log `robot_validades.perf`.")
 
 def main():
     st.set_page_config(page_title="Validação de Stock Robot", layout="wide")
     apply_custom_style()
-    
+    configure_logging()
+
+    if TRACK_MEMORY:
+        enable_memory_tracking()
+    st.sidebar.checkbox(
+        "Ler do CSV só os artigos da lista",
+        value=False,
+        key='csv_pushdown',
+        help="Agrega apenas as linhas do Robot cujos códigos estão no PDF (mais rápido em ficheiros grandes) e lista os artigos que só existem no Robot."
+    )
+    if SNAPSHOT_DIR or HISTORY_DB:
+        st.sidebar.text_input(
+            "Loja",
+            value="principal",
+            key='store_name',
+            help="As execuções são guardadas por loja para mostrar as alterações desde a anterior."
+        )
+
+    with collect() as records:
+        history = get_history_db()
+        if history is None:
+            render_app()
+        else:
+            analysis_tab, history_tab = st.tabs(["Análise", "Histórico"])
+            with analysis_tab:
+                render_app()
+            with history_tab:
+                render_history(history)
+    render_performance_panel(records)
+
+def render_app():
     st.title("Validação de Stock Robot")
     
-    # Initialize session state for dataframes
-    if 'df_pdf' not in st.session_state:
-        st.session_state.df_pdf = None
-    if 'df_csv' not in st.session_state:
-        st.session_state.df_csv = None
+    # The session only keeps the keys of its files; the frames live in the shared result store
+    if 'pdf_key' not in st.session_state:
+        st.session_state.pdf_key = None
+    # Content key of the PDF itself: pdf_key also names the extraction settings
+    if 'pdf_content_key' not in st.session_state:
+        st.session_state.pdf_content_key = None
+    if 'csv_key' not in st.session_state:
+        st.session_state.csv_key = None
+    if 'robot_only_key' not in st.session_state:
+        st.session_state.robot_only_key = None
+    # Content key of the CSVs themselves: csv_key also depends on the list filter
+    if 'csv_content_key' not in st.session_state:
+        st.session_state.csv_content_key = None
 
     st.markdown('<div class="glass-card">', unsafe_allow_html=True)
     st.write("Carregue os ficheiros PDF (Sifarma) e CSV (Robot) para iniciar a validação.")
@@ -118,170 +501,120 @@ def main():
     st.markdown('</div>', unsafe_allow_html=True)
 
     if uploaded_files:
+        parse_cache = get_parse_cache()
+        # PDFs first, so the CSVs can be filtered by the codes of the list
         for uploaded_file in uploaded_files:
-            file_extension = uploaded_file.name.split('.')[-1].lower()
-            
-            # Save temp file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_extension}") as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_path = tmp_file.name
+            if not uploaded_file.name.lower().endswith('.pdf'):
+                continue
+            data = uploaded_file.getvalue()
+            try:
+                with st.spinner(f"Processando PDF: {uploaded_file.name}..."):
+                    key = parse_cache.make_key(f"pdf-{extraction_tag(PDF_BACKEND, PDF_LAYOUT)}", data, PDF_PARSER_VERSION)
+                    df = parse_cache.load(key, lambda: load_pdf(data))
+                    st.session_state.pdf_key = key
+                    st.session_state.pdf_content_key = parse_cache.make_key('pdf', data, PDF_PARSER_VERSION)
+                    st.success(f"PDF carregado: {len(df)} linhas.")
+            except Exception as e:
+                st.error(f"Erro ao processar {uploaded_file.name}: {e}")
 
+        # Every CSV uploaded is part of the robot stock (several robots or partial exports)
+        csv_files = [f for f in uploaded_files if f.name.lower().endswith('.csv')]
+        if csv_files:
+            names = ", ".join(f.name for f in csv_files)
+            datas = [f.getvalue() for f in csv_files]
             try:
-                if file_extension == 'pdf':
-                    with st.spinner(f"Processando PDF: {uploaded_file.name}..."):
-                        df = process_pdf_to_dataframe(tmp_path)
-                        # Reset index to ensure 'Ord.' is available as a column if it was index
-                        if df.index.name == 'Ord.':
-                            df.reset_index(inplace=True)
-                        st.session_state.df_pdf = df
-                        st.success(f"PDF carregado: {len(df)} linhas.")
-                
-                elif file_extension == 'csv':
-                    with st.spinner(f"Processando CSV: {uploaded_file.name}..."):
-                        df = process_csv_to_dataframe(tmp_path)
-                        st.session_state.df_csv = df
+                with st.spinner(f"Processando CSV: {names}..."):
+                    key = combined_csv_key(parse_cache, datas)
+                    content_key = key
+                    df_pdf = None
+                    if st.session_state.get('csv_pushdown') and st.session_state.pdf_key is not None:
+                        df_pdf = parse_cache.get(st.session_state.pdf_key)
+
+                    if df_pdf is not None:
+                        key = filtered_csv_key(key, st.session_state.pdf_key)
+                        df = parse_cache.load(key, lambda: load_csv_for_codes(datas, df_pdf, key))
+                        st.session_state.robot_only_key = robot_only_key(key)
+                        st.success(f"CSV carregado: {len(df)} códigos da lista Sifarma.")
+                    else:
+                        df = parse_cache.load(key, lambda: load_csv(datas))
+                        st.session_state.robot_only_key = None
                         st.success(f"CSV carregado: {len(df)} códigos únicos.")
-            
+                    st.session_state.csv_key = key
+                    st.session_state.csv_content_key = content_key
+                    details = f"Codificação: {df.attrs.get('encoding')} · Formato de data: {df.attrs.get('date_format') or 'inferido'}"
+                    if len(csv_files) > 1:
+                        details += f" · {len(csv_files)} ficheiros, {df.attrs.get('duplicate_rows', 0)} unidades repetidas ignoradas"
+                    st.caption(details)
             except Exception as e:
-                st.error(f"Erro ao processar {uploaded_file.name}: {e}")
-            finally:
-                os.unlink(tmp_path)
+                st.error(f"Erro ao processar {names}: {e}")
 
     # Check if both dataframes are ready
-    if st.session_state.df_pdf is not None and st.session_state.df_csv is not None:
+    if st.session_state.pdf_key is not None and st.session_state.csv_key is not None:
         st.markdown("---")
         st.subheader("Análise Comparativa")
         
         try:
-            final_df = merge_stock_data(st.session_state.df_pdf, st.session_state.df_csv)
-            
-            # Sort by Ord. if available to maintain original order
-            if 'Ord.' in final_df.columns:
-                final_df['Ord.'] = pd.to_numeric(final_df['Ord.'], errors='coerce')
-                final_df.sort_values('Ord.', inplace=True)
-            
+            store = get_result_store()
+            analysis_key = merge_key(st.session_state.pdf_key, st.session_state.csv_key)
+            compact_df = store.get(analysis_key)
+            if compact_df is None:
+                df_pdf = get_parse_cache().get(st.session_state.pdf_key)
+                df_csv = get_parse_cache().get(st.session_state.csv_key)
+                if df_pdf is None or df_csv is None:
+                    st.info("Os dados desta sessão já não estão em memória. Carregue novamente os ficheiros.")
+                    return
+                robot_index = get_robot_index(st.session_state.csv_key, df_csv)
+                compact_df = store.get_or_compute(analysis_key, lambda: compute_analysis(df_pdf, robot_index))
             # Display metrics
-            total_items = len(final_df)
-            error_items = final_df[final_df['Stock errado'] != ""].shape[0]
+            total_items = len(compact_df)
+            error_items = int(divergence_mask(compact_df).sum())
             
             col1, col2 = st.columns(2)
             col1.metric("Total de Itens", total_items)
             col2.metric("Itens com Divergência", error_items, delta_color="inverse")
 
-            # Apply styling
-            styled_df = final_df.style.apply(highlight_errors, axis=1)
-            
-            st.dataframe(
-                styled_df, 
-                width='stretch',
-                height=600,
-                hide_index=True
+            col1, col2, col3 = st.columns([1, 1, 2])
+            divergent_only = col1.checkbox("Só divergências", key='grid_divergent')
+            expiring_months = col2.number_input(
+                "A expirar em (meses)", min_value=0, value=None, step=1, placeholder="Todos", key='grid_expiring',
+                help="Mostra só os artigos com validade (Sifarma ou Robot) até este número de meses a partir do mês atual."
             )
+            search = col3.text_input("Pesquisar Designação", key='grid_search')
+
+            with stage('render', rows_in=total_items) as record:
+                # Stored results are compact; the messages and strings are only rebuilt for the rows shown
+                shown = expand_frame(filter_analysis(compact_df, divergent_only, expiring_months, search.strip()))
+                shown.insert(0, 'Divergente', divergence_mask(shown))
+                
+                st.dataframe(
+                    shown,
+                    column_config=GRID_COLUMNS,
+                    width='stretch',
+                    height=600,
+                    hide_index=True
+                )
+                if len(shown) < total_items:
+                    st.caption(f"A mostrar {len(shown)} de {total_items} itens.")
+                record['rows_out'] = len(shown)
+
+            if st.session_state.robot_only_key is not None:
+                robot_only = get_parse_cache().get(st.session_state.robot_only_key)
+                if robot_only is not None:
+                    with st.expander(f"Artigos só no Robot ({len(robot_only)})", expanded=False):
+                        st.caption("Códigos presentes no Robot mas ausentes da lista Sifarma (número de unidades no CSV).")
+                        st.dataframe(robot_only, width='stretch', hide_index=True)
+
+            store_name = st.session_state.get('store_name') or "principal"
+            snapshots = get_snapshot_store()
+            if snapshots is not None:
+                render_changes(snapshots, store_name, compact_df)
+            history = get_history_db()
+            if history is not None:
+                record_history(history, store_name, compact_df)
             
             # Export Options
-            import io
-            
-            # Excel Generation
-            buffer = io.BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                final_df.to_excel(writer, index=False, sheet_name='Analise_Stock')
-            
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.download_button(
-                    label="📥 Exportar Excel",
-                    data=buffer.getvalue(),
-                    file_name="analise_stock_robot.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    use_container_width=True
-                )
-                
-            with col2:
-                if st.button("🖨️ Imprimir PDF", use_container_width=True):
-                    with st.spinner("Gerando PDF..."):
-                        pdf_buffer = generate_pdf(final_df)
-                        pdf_bytes = pdf_buffer.getvalue()
-                        base64_pdf = base64.b64encode(pdf_bytes).decode('utf-8')
-                        
-                        # Javascript to open PDF in new tab via Blob and provide a working manual link
-                        pdf_display_js = f"""
-                            <html>
-                            <head>
-                            <style>
-                                body {{
-                                    background-color: transparent;
-                                    color: white;
-                                    font-family: "Source Sans Pro", sans-serif;
-                                }}
-                                .btn {{
-                                    display: inline-flex;
-                                    align-items: center;
-                                    justify-content: center;
-                                    padding: 0.5rem 1rem;
-                                    background-color: #ff4b4b;
-                                    color: white;
-                                    text-decoration: none;
-                                    border-radius: 0.5rem;
-                                    font-weight: 600;
-                                    border: 1px solid rgba(255, 255, 255, 0.2);
-                                    transition: background-color 0.3s;
-                                }}
-                                .btn:hover {{ background-color: #ff2b2b; }}
-                            </style>
-                            </head>
-                            <body>
-                            <div style="display: flex; flex-direction: column; align-items: center; gap: 10px;">
-                                <span>Se a aba não abrir, clique aqui:</span>
-                                <a id="pdfLink" href="#" target="_blank" class="btn">📄 Abrir PDF em nova aba</a>
-                            </div>
-                            
-                            <script>
-                                function b64toBlob(b64Data, contentType='', sliceSize=512) {{
-                                    const byteCharacters = atob(b64Data);
-                                    const byteArrays = [];
-
-                                    for (let offset = 0; offset < byteCharacters.length; offset += sliceSize) {{
-                                        const slice = byteCharacters.slice(offset, offset + sliceSize);
-
-                                        const byteNumbers = new Array(slice.length);
-                                        for (let i = 0; i < slice.length; i++) {{
-                                            byteNumbers[i] = slice.charCodeAt(i);
-                                        }}
-
-                                        const byteArray = new Uint8Array(byteNumbers);
-                                        byteArrays.push(byteArray);
-                                    }}
-
-                                    const blob = new Blob(byteArrays, {{type: contentType}});
-                                    return blob;
-                                }}
-
-                                const b64pdf = "{base64_pdf}";
-                                const blob = b64toBlob(b64pdf, "application/pdf");
-                                const blobUrl = URL.createObjectURL(blob);
-                                
-                                const link = document.getElementById('pdfLink');
-                                link.href = blobUrl;
-                                
-                                // Attempt auto-open
-                                window.open(blobUrl, "_blank");
-                            </script>
-                            </body>
-                            </html>
-                        """
-                        # Render component with enough height to show the link
-                        components.html(pdf_display_js, height=100)
-                        
-                        st.success("PDF gerado!")
-                        
-                        st.download_button(
-                            label="⬇️ Baixar PDF",
-                            data=pdf_bytes,
-                            file_name="relatorio_stock.pdf",
-                            mime="application/pdf",
-                            key='pdf-download'
-                        )
+            # The reports are built in the background; this panel polls them while they run
+            render_reports_panel(analysis_key, compact_df)
             
         except Exception as e:
             st.error(f"Erro na fusão dos dados: {e}")
@@ -0,0 +1,200 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from csv_processor import PARSER_VERSION as CSV_PARSER_VERSION
+from excel_exporter import generate_excel
+from parse_cache import ParseCache
+from pdf_exporter import generate_pdf
+from pdf_processor import BACKENDS as PDF_BACKENDS, DEFAULT_BACKEND as PDF_DEFAULT_BACKEND, PARSER_VERSION as PDF_PARSER_VERSION
+from pipeline import reconcile_files
+from snapshot import SnapshotStore, changed_rows, compute_delta
+
+SUMMARY_FILE = "resumo.csv"
+SUMMARY_COLUMNS = ['loja', 'estado', 'itens', 'divergencias', 'fora_do_robot', 'stock_em_excesso', 'alteracoes', 'segundos', 'erro']
+
+def discover_stores(input_dir):
+    """
+    Finds the stores to reconcile in a directory.
+
+    Each sub-directory holding one PDF and one CSV is a store named after the
+    sub-directory. PDF/CSV files directly in `input_dir` form one more store,
+    named after `input_dir` itself.
+
+    Returns:
+        list: (store, pdf_path, csv_path) tuples, sorted by store name. A path is None
+              when the directory does not hold exactly one file of that type.
+    """
+    stores = []
+    candidates = [input_dir] + sorted(
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if os.path.isdir(os.path.join(input_dir, name))
+    )
+    for directory in candidates:
+        files = sorted(os.listdir(directory))
+        pdfs = [f for f in files if f.lower().endswith('.pdf')]
+        csvs = [f for f in files if f.lower().endswith('.csv')]
+        if not pdfs and not csvs:
+            continue
+        store = os.path.basename(os.path.normpath(directory))
+        # Incomplete or ambiguous stores are kept (with None paths) so they are reported as failed
+        pdf_path = os.path.join(directory, pdfs[0]) if len(pdfs) == 1 else None
+        csv_path = os.path.join(directory, csvs[0]) if len(csvs) == 1 else None
+        stores.append((store, pdf_path, csv_path))
+    return sorted(stores, key=lambda entry: entry[0])
+
+def read_manifest(manifest_path):
+    """
+    Reads a manifest CSV (';'-separated) with the columns 'loja', 'pdf' and 'csv'.
+    Relative paths are resolved against the manifest's directory.
+
+    Returns:
+        list: (store, pdf_path, csv_path) tuples, in manifest order.
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    manifest = pd.read_csv(manifest_path, sep=';', dtype=str)
+    missing = {'loja', 'pdf', 'csv'} - set(manifest.columns)
+    if missing:
+        raise ValueError(f"Manifest is missing columns: {sorted(missing)}")
+
+    return [
+        (row.loja, os.path.join(base_dir, row.pdf), os.path.join(base_dir, row.csv))
+        for row in manifest.itertuples(index=False)
+    ]
+
+def reconcile_store(store, pdf_path, csv_path, output_dir, snapshot_dir=None, pdf_backend=PDF_DEFAULT_BACKEND,
+                    pdf_layout=False):
+    """
+    Runs the full reconciliation for one store and writes its Excel and PDF reports.
+    `pdf_backend` is the PDF text extraction engine (see pdf_processor.BACKENDS);
+    `pdf_layout` reads only the table band of each page.
+
+    With `snapshot_dir`, the run is saved there and the changes since the store's
+    previous run are written to '<store>_alteracoes.csv'.
+
+    Never raises: failures are returned in the summary so one bad store does not stop the batch.
+
+    Returns:
+        dict: Summary line for the store.
+    """
+    summary = {'loja': store, 'estado': 'ok', 'itens': None, 'divergencias': None,
+               'fora_do_robot': None, 'stock_em_excesso': None, 'alteracoes': None, 'segundos': None, 'erro': ''}
+    start = time.perf_counter()
+    try:
+        if pdf_path is None or csv_path is None:
+            raise ValueError("Expected exactly one PDF and one CSV for the store")
+
+        df_pdf, df_csv, robot_index, final_df = reconcile_files(pdf_path, [csv_path], backend=pdf_backend,
+                                                                layout=pdf_layout)
+
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, f"{store}_analise_stock_robot.xlsx"), 'wb') as f:
+            f.write(generate_excel(final_df).getvalue())
+        with open(os.path.join(output_dir, f"{store}_relatorio_stock.pdf"), 'wb') as f:
+            f.write(generate_pdf(final_df).getvalue())
+
+        if snapshot_dir:
+            summary['alteracoes'] = _save_snapshot(store, pdf_path, csv_path, df_pdf, df_csv, robot_index,
+                                                   final_df, output_dir, snapshot_dir)
+
+        status = final_df['Stock errado']
+        summary.update({
+            'itens': len(final_df),
+            'divergencias': int((status != "").sum()),
+            'fora_do_robot': int(status.str.endswith("fora do Robot").sum()),
+            'stock_em_excesso': int((status == "Stock em excesso").sum()),
+        })
+    except Exception as e:
+        summary.update({'estado': 'erro', 'erro': f"{type(e).__name__}: {e}"})
+
+    summary['segundos'] = round(time.perf_counter() - start, 2)
+    return summary
+
+def _save_snapshot(store, pdf_path, csv_path, df_pdf, df_csv, robot_index, final_df, output_dir, snapshot_dir):
+    """Saves the run and writes the changes since the previous one. Returns their count (None on a first run)."""
+    # Runs are identified by the files' content (as in the app), not by the extraction settings
+    with open(pdf_path, 'rb') as f:
+        pdf_key = ParseCache.make_key('pdf', f.read(), PDF_PARSER_VERSION)
+    with open(csv_path, 'rb') as f:
+        csv_key = ParseCache.make_key('csv', f.read(), CSV_PARSER_VERSION)
+
+    snapshots = SnapshotStore(snapshot_dir)
+    previous = snapshots.previous(store, pdf_key, csv_key)
+    snapshots.save(store, pdf_key, csv_key, df_pdf, df_csv, final_df)
+    if previous is None:
+        return None
+
+    before = snapshots.load(store, previous['run_id'])
+    changes = changed_rows(compute_delta(before, df_pdf, robot_index), final_df, before['merged'])
+    changes.to_csv(os.path.join(output_dir, f"{store}_alteracoes.csv"), index=False, sep=';', encoding='utf-8-sig')
+    return len(changes)
+
+def run_batch(stores, output_dir, workers=None, progress=print, snapshot_dir=None, pdf_backend=PDF_DEFAULT_BACKEND,
+              pdf_layout=False):
+    """
+    Reconciles every store in a process pool.
+
+    Args:
+        stores (list): (store, pdf_path, csv_path) tuples.
+        output_dir (str): Directory for the per-store reports and the summary CSV.
+        workers (int): Worker processes (None = one per CPU).
+        progress (callable): Receives one line of text per finished store.
+        snapshot_dir (str): If set, each run is saved there and compared with the previous one.
+        pdf_backend (str): PDF text extraction engine (see pdf_processor.BACKENDS).
+        pdf_layout (bool): Read only the table band of each PDF page (see pdf_processor.iter_pdf_rows).
+
+    Returns:
+        pd.DataFrame: Summary with one line per store, in input order.
+    """
+    summaries = [None] * len(stores)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(reconcile_store, store, pdf_path, csv_path, output_dir, snapshot_dir, pdf_backend, pdf_layout): i
+            for i, (store, pdf_path, csv_path) in enumerate(stores)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            store = stores[i][0]
+            try:
+                summary = future.result()
+            except Exception as e:
+                # The worker itself died (e.g. out of memory)
+                summary = {'loja': store, 'estado': 'erro', 'erro': f"{type(e).__name__}: {e}"}
+            summaries[i] = summary
+            detail = summary['erro'] if summary['estado'] == 'erro' else f"{summary['itens']} itens, {summary['divergencias']} divergências"
+            progress(f"[{done}/{len(stores)}] {store}: {summary['estado']} ({detail})")
+
+    summary_df = pd.DataFrame(summaries, columns=SUMMARY_COLUMNS)
+    summary_df = summary_df.astype({c: 'Int64' for c in ['itens', 'divergencias', 'fora_do_robot', 'stock_em_excesso', 'alteracoes']})
+    os.makedirs(output_dir, exist_ok=True)
+    summary_df.to_csv(os.path.join(output_dir, SUMMARY_FILE), index=False, sep=';', encoding='utf-8-sig')
+    return summary_df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile Sifarma PDF / robot CSV pairs for several stores.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-dir", help="Directory with one sub-directory (PDF + CSV) per store")
+    source.add_argument("--manifest", help="';'-separated CSV with columns loja;pdf;csv")
+    parser.add_argument("--output-dir", default="relatorios", help="Where reports are written (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--snapshot-dir", default=None, help="Keep each run here and report the changes since the previous one")
+    parser.add_argument("--pdf-backend", choices=sorted(PDF_BACKENDS), default=PDF_DEFAULT_BACKEND,
+                        help="PDF text extraction engine (default: %(default)s)")
+    parser.add_argument("--pdf-layout", action="store_true", help="Classify PDF lines by position in the table band (slower than the default text mode)")
+    args = parser.parse_args()
+
+    stores = discover_stores(args.input_dir) if args.input_dir else read_manifest(args.manifest)
+    if not stores:
+        print("No stores found.")
+        sys.exit(1)
+
+    print(f"Reconciling {len(stores)} store(s) with {args.workers or os.cpu_count()} worker(s)...")
+    summary_df = run_batch(stores, args.output_dir, workers=args.workers, snapshot_dir=args.snapshot_dir,
+                           pdf_backend=args.pdf_backend, pdf_layout=args.pdf_layout)
+    failed = (summary_df['estado'] != 'ok').sum()
+    print(f"Done: {len(summary_df) - failed} ok, {failed} failed. Summary: {os.path.join(args.output_dir, SUMMARY_FILE)}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,417 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from compact_frames import compact_frame, frame_memory_mb
+from csv_processor import (process_csv_against_codes, process_csv_files_against_codes, process_csv_files_to_dataframe,
+                           process_csv_to_dataframe)
+from data_merger import merge_stock_data
+from excel_exporter import generate_excel
+from instrumentation import collect
+from pdf_exporter import generate_pdf
+from pdf_processor import BACKENDS, process_pdf_to_dataframe
+from pipeline import reconcile_files
+from synthetic_data import generate_dataset
+
+DEFAULT_MERGE_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_PIPELINE_SIZES = [1_000, 10_000, 100_000]
+DEFAULT_MEMORY_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_BACKEND_SIZES = [1_000, 10_000]
+DEFAULT_PARITY_SIZES = [1_000]
+# Chunk sizes checked against the whole-file CSV read (small ones split the date sample)
+PARITY_CHUNKSIZES = [7, 1_000]
+DEFAULT_BASELINE = "benchmark_baseline.json"
+DEFAULT_DATA_DIR = ".bench_data"
+
+def make_merge_inputs(n_rows, seed=0):
+    """
+    Builds synthetic inputs for merge_stock_data.
+
+    Args:
+        n_rows (int): Number of Sifarma lines (and robot barcodes).
+        seed (int): Random seed.
+
+    Returns:
+        tuple: (df_pdf, df_csv) shaped like the outputs of the PDF and CSV processors.
+    """
+    rng = np.random.default_rng(seed)
+    codes = pd.Series(rng.choice(9_000_000, size=n_rows, replace=False) + 1_000_000).astype(str)
+    months = rng.integers(1, 13, size=n_rows)
+    validades = pd.Series([f"{m:02d}-2026" for m in months])
+    stock = rng.integers(0, 10, size=n_rows)
+
+    df_pdf = pd.DataFrame({
+        'Ord.': np.arange(1, n_rows + 1),
+        'Código': codes,
+        'Designação': 'PRODUTO ' + codes,
+        'Stock': stock,
+        'Validade': validades
+    })
+
+    # ~90% of the listed codes are in the robot, with stock off by -1/0/+1
+    in_robot = rng.random(n_rows) < 0.9
+    df_csv = pd.DataFrame({
+        'Código de barras': codes[in_robot].to_numpy(),
+        'stock robot': np.maximum(stock[in_robot] + rng.integers(-1, 2, size=in_robot.sum()), 0),
+        'validade robot': validades[in_robot].to_numpy()
+    })
+    return df_pdf, df_csv
+
+def _rowwise_stock_status(row):
+    """Previous per-row implementation of the 'Stock errado' column, kept for comparison."""
+    sifarma = row['Stock']
+    robot = row['Stock Robot']
+
+    diff = abs(sifarma - robot)
+
+    if sifarma == robot:
+        return ""
+    elif sifarma < robot:
+        return "Stock em excesso"
+    else:
+        return f"{diff} emb fora do Robot"
+
+def _best_time(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def bench_merge(sizes, repeat=3, rowwise_max=100_000):
+    """
+    Times merge_stock_data at each size and, up to `rowwise_max` rows, the row-wise
+    status computation it replaced (checking both give identical strings).
+
+    Returns:
+        pd.DataFrame: One line per size with timings in seconds.
+    """
+    results = []
+    for n_rows in sizes:
+        df_pdf, df_csv = make_merge_inputs(n_rows)
+        merge_time, merged = _best_time(lambda: merge_stock_data(df_pdf, df_csv), repeat)
+
+        rowwise_time = None
+        if n_rows <= rowwise_max:
+            rowwise_time, expected = _best_time(lambda: merged.apply(_rowwise_stock_status, axis=1), 1)
+            if not (expected == merged['Stock errado']).all():
+                raise AssertionError(f"Vectorized status differs from the row-wise version at {n_rows} rows")
+
+        results.append({
+            'rows': n_rows,
+            'merge_s': round(merge_time, 4),
+            'rows_per_s': int(n_rows / merge_time),
+            'rowwise_status_s': None if rowwise_time is None else round(rowwise_time, 4)
+        })
+    return pd.DataFrame(results)
+
+def bench_memory(sizes):
+    """
+    Measures the memory of the frames a session keeps (parsed PDF and CSV) and of the
+    merged analysis, with the parser dtypes and after compact_frame.
+
+    Returns:
+        pd.DataFrame: One line per size with sizes in MB.
+    """
+    results = []
+    for n_rows in sizes:
+        df_pdf, df_csv = make_merge_inputs(n_rows)
+        merged = merge_stock_data(df_pdf, df_csv)
+        frames = {'pdf': df_pdf, 'csv': df_csv, 'merged': merged}
+
+        row = {'rows': n_rows}
+        for name, df in frames.items():
+            row[f'{name}_mb'] = round(frame_memory_mb(df), 3)
+            row[f'{name}_compact_mb'] = round(frame_memory_mb(compact_frame(df)), 3)
+        row['session_mb'] = round(row['pdf_mb'] + row['csv_mb'], 3)
+        row['session_compact_mb'] = round(row['pdf_compact_mb'] + row['csv_compact_mb'], 3)
+        results.append(row)
+    return pd.DataFrame(results)
+
+def load_dataset(n_items, data_dir, seed=0):
+    """
+    Returns (items, pdf bytes, csv bytes) for a synthetic dataset, generating it on first use
+    and keeping the files in `data_dir` so later runs only time the pipeline.
+    """
+    pdf_path = os.path.join(data_dir, f"sifarma_{n_items}_{seed}.pdf")
+    csv_path = os.path.join(data_dir, f"robot_{n_items}_{seed}.csv")
+    items_path = os.path.join(data_dir, f"items_{n_items}_{seed}.csv")
+
+    if not all(os.path.exists(p) for p in (pdf_path, csv_path, items_path)):
+        os.makedirs(data_dir, exist_ok=True)
+        items, pdf_bytes, csv_bytes = generate_dataset(n_items, seed=seed)
+        with open(pdf_path, 'wb') as f:
+            f.write(pdf_bytes)
+        with open(csv_path, 'wb') as f:
+            f.write(csv_bytes)
+        items.to_csv(items_path, index=False)
+        return items, pdf_bytes, csv_bytes
+
+    with open(pdf_path, 'rb') as f:
+        pdf_bytes = f.read()
+    with open(csv_path, 'rb') as f:
+        csv_bytes = f.read()
+    items = pd.read_csv(items_path, dtype={'Código': str, 'Validade': str})
+    return items, pdf_bytes, csv_bytes
+
+def run_pipeline(pdf_bytes, csv_bytes):
+    """Runs every stage once, as the app does, and returns (final_df, stage records)."""
+    with collect() as records:
+        *_, final_df = reconcile_files(pdf_bytes, [csv_bytes])
+        generate_pdf(final_df)
+        generate_excel(final_df)
+    return final_df, records
+
+def bench_pipeline(sizes, data_dir=DEFAULT_DATA_DIR, repeat=1):
+    """
+    Times every pipeline stage on synthetic Sifarma/robot files of each size.
+
+    Returns:
+        pd.DataFrame: One line per (rows, stage) with the best wall time in seconds.
+    """
+    results = []
+    for n_items in sizes:
+        items, pdf_bytes, csv_bytes = load_dataset(n_items, data_dir)
+
+        best = {}
+        for _ in range(repeat):
+            final_df, records = run_pipeline(pdf_bytes, csv_bytes)
+            for record in records:
+                best[record['stage']] = min(best.get(record['stage'], float('inf')), record['wall_s'])
+
+        # The generator and the parser must agree, otherwise the timings are meaningless
+        if len(final_df) != len(items) or list(final_df['Codigo']) != list(items['Código']):
+            raise AssertionError(f"Parsed rows do not match the generated items at {n_items} rows")
+
+        for stage_name, wall_s in best.items():
+            results.append({'rows': n_items, 'stage': stage_name, 'wall_s': round(wall_s, 4)})
+    return pd.DataFrame(results)
+
+def bench_backends(sizes, data_dir=DEFAULT_DATA_DIR, repeat=1, pdf_paths=()):
+    """
+    Times process_pdf_to_dataframe with each text extraction backend, in whole-page text
+    and layout (table band) mode, on synthetic Sifarma PDFs of each size and on the given
+    PDF files, and checks that every combination returns the same rows as pdfplumber's
+    text mode.
+
+    Returns:
+        pd.DataFrame: One line per (file, backend, mode) with the best time and pages per second.
+    """
+    sources = [(f"sintético {n_items}", load_dataset(n_items, data_dir)[1]) for n_items in sizes]
+    for path in pdf_paths:
+        with open(path, 'rb') as f:
+            sources.append((os.path.basename(path), f.read()))
+
+    results = []
+    for name, pdf_bytes in sources:
+        reference = None
+        for backend in BACKENDS:
+            for layout in (False, True):
+                best = None
+                for _ in range(repeat):
+                    with collect() as records:
+                        df = process_pdf_to_dataframe(pdf_bytes, backend=backend, layout=layout)
+                    record = records[-1]
+                    best = record['wall_s'] if best is None else min(best, record['wall_s'])
+                if reference is None:
+                    reference = df
+                results.append({
+                    'file': name,
+                    'backend': backend,
+                    'mode': 'layout' if layout else 'text',
+                    'pages': record.get('pages'),
+                    'rows': len(df),
+                    'wall_s': round(best, 4),
+                    'pages_per_s': round(record.get('pages', 0) / best, 1) if best else None,
+                    'identical': df.equals(reference),
+                })
+    return pd.DataFrame(results)
+
+def _with_blank_barcode(csv_bytes):
+    """The CSV with a unit row without barcode after the header, as robot exports sometimes have."""
+    header, rest = csv_bytes.split(b"\n", 1)
+    return header + b"\n0;;0;1;Robot 1;01/01/2027;Sem codigo\n" + rest
+
+def check_csv_parity(sizes, data_dir=DEFAULT_DATA_DIR):
+    """
+    Checks that every way of reading a robot CSV gives the same aggregate as the
+    whole-file read: chunked (PARITY_CHUNKSIZES) and through the several-files reader,
+    on the synthetic CSVs and on a copy with a blank barcode row.
+
+    The readers filtered by the Sifarma codes (pushdown) must give the whole-file
+    aggregate restricted to those codes, and count as robot-only units the stock of
+    every other barcode.
+
+    Returns:
+        pd.DataFrame: One line per (file, reader) with its row count and whether it matched.
+    """
+    results = []
+    for n_items in sizes:
+        items, _, csv_bytes = load_dataset(n_items, data_dir)
+        codes = items['Código'].astype(str)
+        for name, data in ((f"sintético {n_items}", csv_bytes),
+                           (f"sintético {n_items} + código vazio", _with_blank_barcode(csv_bytes))):
+            reference = process_csv_to_dataframe(data)
+            listed = reference['Código de barras'].isin(codes)
+            pushdown_reference = reference[listed].reset_index(drop=True)
+            robot_only_reference = reference.loc[~listed, ['Código de barras', 'stock robot']].rename(
+                columns={'stock robot': 'unidades robot'}).reset_index(drop=True)
+
+            pushdown = {f"lista, chunksize={size}": lambda size=size: process_csv_against_codes(data, codes, chunksize=size)
+                        for size in [None] + PARITY_CHUNKSIZES}
+            pushdown['lista, vários ficheiros'] = lambda: process_csv_files_against_codes([data], codes, workers=1)
+            for reader, read in pushdown.items():
+                df, robot_only = read()
+                robot_only = robot_only.astype({'unidades robot': reference['stock robot'].dtype})
+                results.append({'file': name, 'reader': reader, 'rows': len(df),
+                                'identical': df.equals(pushdown_reference) and robot_only.equals(robot_only_reference)})
+            readers = {f"chunksize={size}": lambda size=size: process_csv_to_dataframe(data, chunksize=size)
+                       for size in PARITY_CHUNKSIZES}
+            readers['vários ficheiros'] = lambda: process_csv_files_to_dataframe([data], workers=1)
+            readers['vários ficheiros, chunksize'] = lambda: process_csv_files_to_dataframe(
+                [data], chunksize=PARITY_CHUNKSIZES[0], workers=1)
+            for reader, read in readers.items():
+                df = read()
+                results.append({'file': name, 'reader': reader, 'rows': len(df), 'identical': df.equals(reference)})
+    return pd.DataFrame(results)
+
+def check_regressions(results, baseline, tolerance=0.25, min_delta=0.05):
+    """
+    Compares stage timings with a baseline.
+
+    A stage regresses when it is slower than the baseline by more than `tolerance`
+    (relative) and by more than `min_delta` seconds, so tiny stages do not fail on noise.
+
+    Returns:
+        list: Human-readable regression messages (empty if none).
+    """
+    regressions = []
+    for row in results.itertuples(index=False):
+        reference = baseline.get(str(row.rows), {}).get(row.stage)
+        if reference is None:
+            continue
+        if row.wall_s > reference * (1 + tolerance) and row.wall_s - reference > min_delta:
+            regressions.append(f"{row.stage} @ {row.rows} rows: {row.wall_s:.3f}s vs baseline {reference:.3f}s")
+    return regressions
+
+def missing_from_baseline(results, baseline):
+    """
+    Lists the measured sizes and stages the baseline has no timing for, which
+    check_regressions cannot check.
+
+    Returns:
+        list: Human-readable messages (empty if every timing has a reference).
+    """
+    return [
+        f"{row.stage} @ {row.rows} rows"
+        for row in results.itertuples(index=False)
+        if baseline.get(str(row.rows), {}).get(row.stage) is None
+    ]
+
+def results_to_baseline(results):
+    """Converts pipeline results to the baseline JSON layout: {rows: {stage: seconds}}."""
+    baseline = {}
+    for row in results.itertuples(index=False):
+        baseline.setdefault(str(row.rows), {})[row.stage] = row.wall_s
+    return baseline
+
+def _parse_sizes(text):
+    return [int(n) for n in text.split(",")]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the Sifarma vs Robot pipeline.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    merge_parser = commands.add_parser("merge", help="Scaling of merge_stock_data on in-memory frames")
+    merge_parser.add_argument("--sizes", default=",".join(str(n) for n in DEFAULT_MERGE_SIZES),
+                              help="Comma-separated row counts (default: %(default)s)")
+    merge_parser.add_argument("--repeat", type=int, default=3, help="Repetitions per size; the best time is kept")
+
+    memory_parser = commands.add_parser("memory", help="Memory per session of the parsed frames, before and after compact_frame")
+    memory_parser.add_argument("--sizes", default=",".join(str(n) for n in DEFAULT_MEMORY_SIZES),
+                               help="Comma-separated row counts (default: %(default)s)")
+
+    backends_parser = commands.add_parser("backends", help="Pages per second of each PDF text extraction backend and mode")
+    backends_parser.add_argument("--sizes", default=",".join(str(n) for n in DEFAULT_BACKEND_SIZES),
+                                 help="Comma-separated item counts of the synthetic PDFs (default: %(default)s)")
+    backends_parser.add_argument("--repeat", type=int, default=1, help="Repetitions per file; the best time is kept")
+    backends_parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Where generated files are kept (default: %(default)s)")
+    backends_parser.add_argument("--pdf", action="append", default=[], help="Also time this PDF file (repeatable)")
+
+    parity_parser = commands.add_parser("csv-parity", help="Same robot aggregate from every CSV reading path")
+    parity_parser.add_argument("--sizes", default=",".join(str(n) for n in DEFAULT_PARITY_SIZES),
+                               help="Comma-separated item counts of the synthetic CSVs (default: %(default)s)")
+    parity_parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Where generated files are kept (default: %(default)s)")
+
+    pipeline_parser = commands.add_parser("pipeline", help="Every stage on synthetic PDF/CSV files, checked against a baseline")
+    pipeline_parser.add_argument("--sizes", default=",".join(str(n) for n in DEFAULT_PIPELINE_SIZES),
+                                 help="Comma-separated item counts (default: %(default)s)")
+    pipeline_parser.add_argument("--repeat", type=int, default=1, help="Repetitions per size; the best time is kept")
+    pipeline_parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Where generated files are kept (default: %(default)s)")
+    pipeline_parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file (default: %(default)s)")
+    pipeline_parser.add_argument("--update-baseline", action="store_true", help="Store this run as the new baseline")
+    pipeline_parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown (default: %(default)s)")
+    pipeline_parser.add_argument("--allow-missing-baseline", action="store_true",
+                                 help="Do not fail when the baseline is missing or lacks a measured size/stage")
+
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        print(bench_merge(_parse_sizes(args.sizes), repeat=args.repeat).to_string(index=False))
+        sys.exit(0)
+
+    if args.command == "memory":
+        print(bench_memory(_parse_sizes(args.sizes)).to_string(index=False))
+        sys.exit(0)
+
+    if args.command == "backends":
+        results = bench_backends(_parse_sizes(args.sizes), data_dir=args.data_dir, repeat=args.repeat, pdf_paths=args.pdf)
+        print(results.to_string(index=False))
+        sys.exit(0 if results['identical'].all() else 1)
+
+    if args.command == "csv-parity":
+        results = check_csv_parity(_parse_sizes(args.sizes), data_dir=args.data_dir)
+        print(results.to_string(index=False))
+        sys.exit(0 if results['identical'].all() else 1)
+
+    results = bench_pipeline(_parse_sizes(args.sizes), data_dir=args.data_dir, repeat=args.repeat)
+    print(results.pivot(index='stage', columns='rows', values='wall_s').to_string())
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+        for size, stages in results_to_baseline(results).items():
+            baseline[size] = stages
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = check_regressions(results, baseline, tolerance=args.tolerance)
+        missing = missing_from_baseline(results, baseline)
+        if regressions:
+            print("Regressions:")
+            for message in regressions:
+                print(f"  {message}")
+        if missing:
+            print("Not in the baseline (run with --update-baseline to add them):")
+            for message in missing:
+                print(f"  {message}")
+        if regressions or (missing and not args.allow_missing_baseline):
+            sys.exit(1)
+        print("No regressions against the baseline.")
+    else:
+        # Without a baseline nothing is checked, so a default run must not pass silently
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one.")
+        sys.exit(0 if args.allow_missing_baseline else 1)
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+from data_merger import calculate_stock_status, stock_status_category
+
+# Columns of the parsed (PDF/CSV) and merged frames, by kind of value
+CODE_COLUMNS = ['Código', 'Código de barras', 'Codigo']
+INT_COLUMNS = ['Ord.', 'Stock', 'stock robot', 'Stock Robot']
+VALIDITY_COLUMNS = ['Validade', 'validade robot', 'Validade Sifarma', 'Validade Real']
+VALIDITY_FORMAT = '%m-%Y'
+STATUS_COLUMN = 'Stock errado'
+# Replaces STATUS_COLUMN in compact frames
+COMPACT_STATUS_COLUMN = 'Estado'
+
+_MB = 1024 * 1024
+_INT32 = np.iinfo(np.int32)
+
+
+def compact_frame(df):
+    """
+    Returns a copy of a parsed or merged frame with compact dtypes:
+
+    - CNP codes / barcodes as integers (int32 when they fit, else int64), or as a
+      category when they are not plain digit strings;
+    - stocks and Ord. as int32;
+    - MM-YYYY validities as monthly periods;
+    - the 'Stock errado' message replaced by the categorical 'Estado' column.
+
+    Only the columns present are converted. expand_frame restores the original frame
+    exactly; the details needed for that are kept in `attrs['compact']`.
+
+    Args:
+        df (pd.DataFrame): Output of process_pdf_to_dataframe (with 'Ord.' as a column),
+                           process_csv_to_dataframe or merge_stock_data.
+
+    Returns:
+        pd.DataFrame: Compact copy of `df`.
+    """
+    if 'compact' in df.attrs:
+        return df
+
+    compact = df.copy()
+    info = {'dtypes': {}, 'code_widths': {}, 'validity': [], 'status': False}
+
+    for column in compact.columns.intersection(CODE_COLUMNS):
+        info['dtypes'][column] = str(compact[column].dtype)
+        compact[column], info['code_widths'][column] = _compact_codes(compact[column])
+
+    for column in compact.columns.intersection(INT_COLUMNS):
+        values = compact[column]
+        if pd.api.types.is_integer_dtype(values) and (values.empty or (values.min() >= _INT32.min and values.max() <= _INT32.max)):
+            info['dtypes'][column] = str(values.dtype)
+            compact[column] = values.astype(np.int32)
+
+    for column in compact.columns.intersection(VALIDITY_COLUMNS):
+        periods = _compact_validity(compact[column])
+        if periods is not None:
+            info['dtypes'][column] = str(compact[column].dtype)
+            info['validity'].append(column)
+            compact[column] = periods
+
+    if STATUS_COLUMN in compact.columns and {'Stock', 'Stock Robot'} <= set(compact.columns):
+        # The message only depends on the two stocks, so the category is enough to rebuild it
+        status = stock_status_category(compact['Stock'], compact['Stock Robot'])
+        compact[STATUS_COLUMN] = status
+        compact.rename(columns={STATUS_COLUMN: COMPACT_STATUS_COLUMN}, inplace=True)
+        info['status'] = True
+
+    compact.attrs['compact'] = info
+    return compact
+
+
+def expand_frame(df):
+    """
+    Inverse of compact_frame: restores the string codes, MM-YYYY validities, original
+    integer dtypes and the 'Stock errado' messages. Frames that are not compact are
+    returned unchanged.
+    """
+    info = df.attrs.get('compact')
+    if info is None:
+        return df
+
+    expanded = df.copy()
+    expanded.attrs = {k: v for k, v in df.attrs.items() if k != 'compact'}
+
+    for column, width in info['code_widths'].items():
+        values = expanded[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        else:
+            values = values.astype(str)
+            if width:
+                values = values.str.zfill(width)
+        expanded[column] = values.astype(info['dtypes'][column])
+
+    for column in info['validity']:
+        expanded[column] = _format_validity(expanded[column]).astype(info['dtypes'][column])
+
+    for column, dtype in info['dtypes'].items():
+        if column in INT_COLUMNS:
+            expanded[column] = expanded[column].astype(dtype)
+
+    if info['status']:
+        expanded[COMPACT_STATUS_COLUMN] = calculate_stock_status(expanded['Stock'], expanded['Stock Robot'])
+        expanded.rename(columns={COMPACT_STATUS_COLUMN: STATUS_COLUMN}, inplace=True)
+
+    return expanded
+
+
+def frame_memory_mb(df):
+    """Memory held by a DataFrame (values and index, strings included), in MB."""
+    if df is None:
+        return 0.0
+    return df.memory_usage(index=True, deep=True).sum() / _MB
+
+
+def _compact_codes(codes):
+    """
+    Encodes a code column as integers when that is lossless, else as a category.
+
+    Returns:
+        tuple: (encoded Series, zero-padding width to restore, 0 for none).
+    """
+    text = codes.astype(str)
+    if codes.isna().any() or not text.str.fullmatch(r'\d{1,18}').all():
+        return codes.astype('category'), 0
+
+    lengths = text.str.len()
+    # Codes of a single length may keep their leading zeros; otherwise none may have one
+    width = int(lengths.iloc[0]) if len(text) and (lengths == lengths.iloc[0]).all() else 0
+    values = text.astype(np.int64)
+    restored = values.astype(str)
+    if width:
+        restored = restored.str.zfill(width)
+    if not (restored == text).all():
+        return codes.astype('category'), 0
+
+    if values.empty or values.max() <= _INT32.max:
+        values = values.astype(np.int32)
+    return values, width
+
+
+def _format_validity(periods):
+    """MM-YYYY strings for a period column, formatting each distinct month only once."""
+    codes, months = pd.factorize(periods)
+    formatted = np.append(months.strftime(VALIDITY_FORMAT).to_numpy(dtype=object), np.nan)
+    # Missing values have code -1, which picks the NaN appended above
+    return pd.Series(formatted[codes], index=periods.index, name=periods.name)
+
+
+def _compact_validity(values):
+    """Monthly periods for a MM-YYYY column, or None if some value is not in that format."""
+    periods = pd.to_datetime(values, format=VALIDITY_FORMAT, errors='coerce').dt.to_period('M')
+    if (periods.isna() != values.isna()).any():
+        return None
+    return periods
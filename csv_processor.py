@@ -1,36 +1,137 @@
 import pandas as pd
 import sys
 import os
+import codecs
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import repeat
 
-def process_csv_to_dataframe(csv_path):
+from instrumentation import stage, count
+
+# Bump when the aggregated output changes, so cached parses are invalidated
+PARSER_VERSION = 1
+
+# Bytes read from the start of the file to guess its encoding
+ENCODING_SAMPLE_BYTES = 64 * 1024
+# Non-empty date values used to pick the date format
+DATE_SAMPLE_SIZE = 200
+# Day-first formats tried, in order, on the date sample
+DATE_FORMATS = [
+    '%d/%m/%Y',
+    '%d-%m-%Y',
+    '%d/%m/%Y %H:%M:%S',
+    '%d-%m-%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%d-%m-%Y %H:%M',
+    '%Y-%m-%d',
+]
+
+def _open_source(source):
     """
-    Reads a stock maintenance CSV file and calculates stock and minimum validity per barcode.
+    Validates a path, or wraps raw bytes / non-seekable streams in a seekable buffer,
+    so the file can be re-read with another encoding.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"File not found: {source}")
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return BytesIO(source)
+    if not (hasattr(source, 'seekable') and source.seekable()):
+        return BytesIO(source.read())
+    return source
+
+def _read_csv(source, **kwargs):
+    """Reads the CSV from the start of `source` (rewinding buffers between attempts)."""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return pd.read_csv(source, sep=';', **kwargs)
+
+def _sniff_encoding(source):
+    """
+    Guesses the file encoding from a leading byte sample.
     
-    Args:
-        csv_path (str): Path to the CSV file.
-        
     Returns:
-        pd.DataFrame: DataFrame with columns ['Código de barras', 'stock robot', 'validade robot'].
-                      'validade robot' will be in string format (DD-MM-YYYY).
+        str: 'utf-8' if the sample is valid UTF-8, otherwise 'latin1'.
     """
-    if not os.path.exists(csv_path):
-        raise FileNotFoundError(f"File not found: {csv_path}")
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            sample = f.read(ENCODING_SAMPLE_BYTES)
+    else:
+        source.seek(0)
+        sample = source.read(ENCODING_SAMPLE_BYTES)
+        source.seek(0)
 
-    # Try reading with different encodings
+    # Incremental decoding tolerates a multi-byte character cut at the end of the sample
     try:
-        df = pd.read_csv(csv_path, sep=';', encoding='utf-8')
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
     except UnicodeDecodeError:
-        try:
-            df = pd.read_csv(csv_path, sep=';', encoding='latin1')
-        except Exception as e:
-            raise ValueError(f"Could not read CSV with utf-8 or latin1 encoding: {e}")
+        return 'latin1'
 
+def _detect_date_format(values):
+    """
+    Picks the first format in DATE_FORMATS that parses every value of a small sample.
+    
+    Returns:
+        str | None: strptime format, or None if no candidate fits (dayfirst inference is used).
+    """
+    sample = values.dropna().astype(str).str.strip()
+    sample = sample[sample != ''].head(DATE_SAMPLE_SIZE)
+    if sample.empty:
+        return None
+
+    for date_format in DATE_FORMATS:
+        if pd.to_datetime(sample, format=date_format, errors='coerce').notna().all():
+            return date_format
+    return None
+
+def _sample_date_format(source, encoding, date_col):
+    """
+    Detects the date format from the first DATE_SAMPLE_SIZE non-empty dates of the file,
+    read ahead of the chunks, so the chunk size cannot change the format (and the output).
+    """
+    sample = []
+    found = 0
+    with _read_csv(source, encoding=encoding, usecols=[date_col], dtype=str,
+                   chunksize=DATE_SAMPLE_SIZE) as reader:
+        for chunk in reader:
+            dates = chunk[date_col].dropna().str.strip()
+            sample.append(dates[dates != ''])
+            found += len(sample[-1])
+            if found >= DATE_SAMPLE_SIZE:
+                break
+    return _detect_date_format(pd.concat(sample)) if sample else None
+
+def _parse_dates(values, date_format):
+    """Parses validity dates with an explicit format, falling back to dayfirst inference."""
+    # Inference is per value ('mixed'), never guessed from the first value of the batch,
+    # so a chunk parses its rows exactly as the whole-file read does
+    if date_format is None:
+        # Use dayfirst=True to handle DD/MM/YYYY or DD-MM-YYYY formats robustly
+        return pd.to_datetime(values, format='mixed', dayfirst=True, errors='coerce')
+
+    dates = pd.to_datetime(values, format=date_format, errors='coerce')
+
+    # Values outside the detected format (if any) still get the previous inference
+    failed = dates.isna() & values.notna()
+    if failed.any():
+        dates[failed] = pd.to_datetime(values[failed], format='mixed', dayfirst=True, errors='coerce')
+    return dates
+
+def _find_columns(columns):
+    """
+    Finds the barcode and validity date columns.
+    
+    Returns:
+        tuple: (code column, date column) names.
+    """
     # Normalize column names to handle encoding issues like "Cdigo"
     # We look for a column that looks like "Codigo de barras"
     target_code_col = None
     target_date_col = None
     
-    for col in df.columns:
+    for col in columns:
         if "digo de barras" in col or "Codigo de barras" in col or "Código de barras" in col:
             target_code_col = col
         if "Data de validade" in col:
@@ -40,41 +141,368 @@ def process_csv_to_dataframe(csv_path):
         # Fallback: try by index if names fail (1: Code, 5: Date based on sample)
         # Ord.;Cdigo de barras;Unidade;Dosagem;Armazenado em;Data de validade;Nome do artigo
         # 0     1                2       3        4              5                 6
-        if len(df.columns) >= 6:
-            target_code_col = df.columns[1]
-            target_date_col = df.columns[5]
+        if len(columns) >= 6:
+            target_code_col = columns[1]
+            target_date_col = columns[5]
         else:
-            raise ValueError(f"Required columns not found. Available: {df.columns.tolist()}")
+            raise ValueError(f"Required columns not found. Available: {list(columns)}")
+
+    return target_code_col, target_date_col
+
+def _aggregate_units(df, code_col, date_col, date_format):
+    """
+    Cleans unit rows and aggregates them per barcode.
+    
+    Returns:
+        pd.DataFrame: Indexed by barcode, with columns 'stock_robot' (unit count) and
+                      'validade_robot' (earliest date, as datetime).
+    """
+    count('rows_in', len(df))
 
     # Ensure Code is string to prevent numeric issues
-    df[target_code_col] = df[target_code_col].astype(str).str.strip()
+    codes = df[code_col].astype(str).str.strip()
     
     # Filter out empty codes or rows that are just separators
-    df = df[df[target_code_col] != 'nan']
-    df = df[df[target_code_col] != '']
+    valid = (codes != 'nan') & (codes != '')
 
     # Convert Date column to datetime
-    # Use dayfirst=True to handle DD/MM/YYYY or DD-MM-YYYY formats robustly
-    df['date_obj'] = pd.to_datetime(df[target_date_col], dayfirst=True, errors='coerce')
+    units = pd.DataFrame({
+        'code': codes[valid],
+        'date_obj': _parse_dates(df.loc[valid, date_col], date_format)
+    })
     
     # Drop rows with invalid dates if necessary, or keep them? 
     # For now, we drop NaT to ensure sorting works
-    df = df.dropna(subset=['date_obj'])
+    units = units.dropna(subset=['date_obj'])
 
     # Group by Barcode
-    grouped = df.groupby(target_code_col).agg(
+    return units.groupby('code').agg(
         stock_robot=('date_obj', 'count'),
         validade_robot=('date_obj', 'min')
-    ).reset_index()
+    )
+
+def _split_on_codes(df, code_col, codes):
+    """
+    Keeps the unit rows whose barcode is in `codes` and counts the others per barcode,
+    without parsing their dates.
+    
+    Returns:
+        tuple: (matching rows, pd.Series of unit rows per robot-only barcode).
+    """
+    barcodes = df[code_col].astype(str).str.strip()
+    wanted = barcodes.isin(codes)
+    others = barcodes[~wanted]
+    others = others[(others != 'nan') & (others != '')]
+
+    # Rows read but not aggregated still count as input of the stage
+    count('rows_in', len(df) - int(wanted.sum()))
+    count('rows_filtered', len(df) - int(wanted.sum()))
+    return df[wanted], others.value_counts()
+
+def _combine_aggregates(left, right):
+    """Merges two partial aggregates: counts are summed and the earliest date is kept."""
+    if left is None:
+        return right
+    return pd.concat([left, right]).groupby(level=0).agg(
+        stock_robot=('stock_robot', 'sum'),
+        validade_robot=('validade_robot', 'min')
+    )
+
+def _format_output(grouped):
+    """Turns the per-barcode aggregate into the public output layout."""
+    grouped = grouped.rename_axis('Código de barras').reset_index()
 
     # Rename columns for output
-    grouped.rename(columns={target_code_col: 'Código de barras', 'stock_robot': 'stock robot', 'validade_robot': 'validade robot'}, inplace=True)
+    grouped.rename(columns={'stock_robot': 'stock robot', 'validade_robot': 'validade robot'}, inplace=True)
 
     # Format the date back to string MM-YYYY
     grouped['validade robot'] = grouped['validade robot'].dt.strftime('%m-%Y')
 
     return grouped
 
+def _aggregate_chunks(source, encoding, chunksize, codes=None):
+    """Streams the CSV in chunks, reading only the barcode and date columns."""
+    header = _read_csv(source, encoding=encoding, nrows=0)
+    code_col, date_col = _find_columns(header.columns)
+
+    # The format is detected once, on the same sample as the whole-file read, and
+    # reused for every chunk
+    date_format = _sample_date_format(source, encoding, date_col)
+
+    grouped = None
+    robot_only = []
+    for chunk in _read_csv(source, encoding=encoding, usecols=[code_col, date_col],
+                           dtype={code_col: str}, chunksize=chunksize):
+        if codes is not None:
+            chunk, others = _split_on_codes(chunk, code_col, codes)
+            robot_only.append(others)
+        grouped = _combine_aggregates(grouped, _aggregate_units(chunk, code_col, date_col, date_format))
+
+    if grouped is None:
+        grouped = _aggregate_units(header, code_col, date_col, date_format)
+    # Per-chunk counts are summed once at the end
+    robot_only = pd.concat(robot_only).groupby(level=0).sum() if robot_only else None
+    if codes is not None and robot_only is None:
+        robot_only = pd.Series(dtype=int)
+    return grouped, date_format, robot_only
+
+def _aggregate(source, encoding, chunksize, codes=None):
+    """
+    Reads the whole file (or streams it in chunks) and aggregates it per barcode.
+    With `codes`, only the rows of those barcodes are aggregated and the others are counted.
+    
+    Returns:
+        tuple: (aggregate, detected date format, robot-only unit counts or None).
+    """
+    if chunksize:
+        return _aggregate_chunks(source, encoding, chunksize, codes)
+
+    # Barcodes are read as text in every path: with a blank barcode the column would
+    # otherwise be parsed as floats ("5323951.0")
+    header = _read_csv(source, encoding=encoding, nrows=0)
+    code_col, date_col = _find_columns(header.columns)
+    df = _read_csv(source, encoding=encoding, dtype={code_col: str})
+    date_format = _detect_date_format(df[date_col])
+    robot_only = None
+    if codes is not None:
+        df, robot_only = _split_on_codes(df, code_col, codes)
+    return _aggregate_units(df, code_col, date_col, date_format), date_format, robot_only
+
+def _process(source, chunksize, codes):
+    """Shared body of process_csv_to_dataframe and process_csv_against_codes."""
+    source = _open_source(source)
+
+    # The encoding is guessed from a leading sample; if a later byte still breaks
+    # UTF-8 the file is read again as latin1
+    with stage('csv_parse', chunksize=chunksize, filtered=codes is not None) as record:
+        encoding = _sniff_encoding(source)
+        try:
+            grouped, date_format, robot_only = _aggregate(source, encoding, chunksize, codes)
+        except UnicodeDecodeError:
+            encoding = 'latin1'
+            record['rows_in'] = None
+            record.pop('rows_filtered', None)
+            try:
+                grouped, date_format, robot_only = _aggregate(source, encoding, chunksize, codes)
+            except Exception as e:
+                raise ValueError(f"Could not read CSV with utf-8 or latin1 encoding: {e}")
+
+        result = _format_output(grouped)
+        result.attrs['encoding'] = encoding
+        result.attrs['date_format'] = date_format
+        record['rows_out'] = len(result)
+    return result, robot_only
+
+def _picklable_source(source):
+    """Returns a path or bytes that can be sent to worker processes."""
+    if isinstance(source, (str, os.PathLike, bytes)):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    source.seek(0)
+    return source.read()
+
+def _unit_counts(df, code_col, date_col):
+    """
+    Collapses unit rows to one line per distinct row content, keyed by a 64-bit hash of
+    every column but 'Ord.' (the export's line number).
+    
+    Returns:
+        pd.DataFrame: Indexed by row hash, with the barcode 'code', the raw 'date' and
+                      'n', the number of rows with that content.
+    """
+    codes = df[code_col].astype(str).str.strip()
+    valid = ((codes != 'nan') & (codes != '')).to_numpy()
+    df, codes = df[valid], codes[valid]
+
+    content = df[[c for c in df.columns if not str(c).startswith('Ord')]]
+    units = pd.DataFrame({
+        'row_hash': pd.util.hash_pandas_object(content, index=False).to_numpy(),
+        'code': codes.to_numpy(),
+        'date': df[date_col].to_numpy(),
+    })
+    return units.groupby('row_hash', sort=False).agg(code=('code', 'first'), date=('date', 'first'), n=('code', 'size'))
+
+def _read_units(source, encoding, chunksize):
+    """
+    Reads one CSV (whole, or in chunks) into _unit_counts lines, every column as text.
+    
+    Returns:
+        tuple: (unit counts, detected date format, rows read).
+    """
+    header = _read_csv(source, encoding=encoding, dtype=str, nrows=0)
+    code_col, date_col = _find_columns(header.columns)
+    if chunksize:
+        # The format is detected once, ahead of the chunks, and reused for all of them
+        date_format = _sample_date_format(source, encoding, date_col)
+        chunks = _read_csv(source, encoding=encoding, dtype=str, chunksize=chunksize)
+    else:
+        chunks = [_read_csv(source, encoding=encoding, dtype=str)]
+        date_format = _detect_date_format(chunks[0][date_col])
+
+    parts = []
+    rows = 0
+    for chunk in chunks:
+        rows += len(chunk)
+        parts.append(_unit_counts(chunk, code_col, date_col))
+
+    if not parts:
+        return _unit_counts(header, code_col, date_col), date_format, rows
+    units = parts[0] if len(parts) == 1 else pd.concat(parts).groupby(level=0, sort=False).agg(
+        code=('code', 'first'), date=('date', 'first'), n=('n', 'sum'))
+    return units, date_format, rows
+
+def _read_file_units(source, chunksize, codes=None):
+    """
+    Worker: unit counts of one CSV file, with its dates parsed (with `codes`, only those
+    of the listed barcodes; the others are left empty).
+    
+    Returns:
+        tuple: (unit counts, encoding, date format, rows read).
+    """
+    source = _open_source(source)
+    encoding = _sniff_encoding(source)
+    try:
+        units, date_format, rows = _read_units(source, encoding, chunksize)
+    except UnicodeDecodeError:
+        encoding = 'latin1'
+        try:
+            units, date_format, rows = _read_units(source, encoding, chunksize)
+        except Exception as e:
+            raise ValueError(f"Could not read CSV with utf-8 or latin1 encoding: {e}")
+
+    dates = units['date']
+    if codes is not None:
+        dates = dates.where(units['code'].isin(codes))
+    units['date'] = _parse_dates(dates, date_format)
+    return units, encoding, date_format, rows
+
+def _process_files(sources, chunksize, workers, codes):
+    """Shared body of process_csv_files_to_dataframe and process_csv_files_against_codes."""
+    sources = [_picklable_source(source) for source in sources]
+    if not sources:
+        raise ValueError("No CSV files given")
+
+    workers = min(workers or os.cpu_count() or 1, len(sources))
+    with stage('csv_parse', chunksize=chunksize, filtered=codes is not None, files=len(sources),
+               workers=workers) as record:
+        if workers <= 1:
+            results = [_read_file_units(source, chunksize, codes) for source in sources]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_read_file_units, sources, repeat(chunksize), repeat(codes)))
+
+        # A unit exported by several files is counted once: each distinct row content
+        # keeps the largest number of rows it has in any one file
+        per_file = [units for units, _, _, _ in results]
+        units = pd.concat(per_file).groupby(level=0, sort=False).agg(
+            code=('code', 'first'), date=('date', 'first'), n=('n', 'max'))
+        count('rows_in', sum(rows for _, _, _, rows in results))
+        record['rows_duplicate'] = int(sum(part['n'].sum() for part in per_file) - units['n'].sum())
+
+        robot_only = None
+        if codes is not None:
+            wanted = units['code'].isin(codes)
+            robot_only = units.loc[~wanted].groupby('code')['n'].sum()
+            units = units[wanted]
+        units = units.dropna(subset=['date'])
+        grouped = units.groupby('code').agg(stock_robot=('n', 'sum'), validade_robot=('date', 'min'))
+
+        result = _format_output(grouped)
+        encodings = list(dict.fromkeys(encoding for _, encoding, _, _ in results))
+        date_formats = list(dict.fromkeys(date_format for _, _, date_format, _ in results if date_format))
+        result.attrs['encoding'] = ', '.join(encodings)
+        result.attrs['date_format'] = ', '.join(date_formats) or None
+        result.attrs['files'] = len(sources)
+        result.attrs['duplicate_rows'] = record['rows_duplicate']
+        record['rows_out'] = len(result)
+    return result, robot_only
+
+def process_csv_to_dataframe(source, chunksize=None):
+    """
+    Reads a stock maintenance CSV file and calculates stock and minimum validity per barcode.
+    
+    Args:
+        source (str | bytes | file-like): Path to the CSV file, its raw bytes or a binary buffer.
+        chunksize (int): If set, the file is streamed in chunks of this many rows, reading only
+                         the barcode and date columns (as text) and merging per-chunk aggregates.
+                         Peak memory then depends on the number of distinct barcodes, not rows.
+        
+    Returns:
+        pd.DataFrame: DataFrame with columns ['Código de barras', 'stock robot', 'validade robot'].
+                      'validade robot' will be in string format (MM-YYYY).
+                      `attrs['encoding']` and `attrs['date_format']` report the detected
+                      encoding and date format (None if dates were inferred per value).
+    """
+    result, _ = _process(source, chunksize, codes=None)
+    return result
+
+def process_csv_against_codes(source, codes, chunksize=None):
+    """
+    Like process_csv_to_dataframe, but only aggregates the barcodes in `codes` (e.g. the
+    CNP codes of the Sifarma list): other rows are dropped before the dates are parsed
+    and grouped, which is all merge_stock_data needs from the robot file.
+    
+    The dropped rows are counted per barcode in the same pass, giving the robot-only items.
+    
+    Args:
+        source (str | bytes | file-like): Path to the CSV file, its raw bytes or a binary buffer.
+        codes (iterable): Barcodes to keep (compared as stripped strings).
+        chunksize (int): See process_csv_to_dataframe.
+        
+    Returns:
+        tuple: (aggregate in the process_csv_to_dataframe layout, restricted to `codes`;
+                pd.DataFrame of robot-only barcodes with columns ['Código de barras',
+                'unidades robot'], the number of unit rows, whose dates are not parsed).
+    """
+    codes = pd.Index(pd.Series(list(codes), dtype=str).str.strip()).unique()
+    result, robot_only = _process(source, chunksize, codes)
+
+    robot_only = robot_only.rename_axis('Código de barras').rename('unidades robot').sort_index().reset_index()
+    return result, robot_only
+
+def process_csv_files_to_dataframe(sources, chunksize=None, workers=None):
+    """
+    Like process_csv_to_dataframe, for several robot exports of one store (e.g. one per
+    robot, or partial exports that overlap). The files are read concurrently and their
+    units combined: counts are summed and the earliest validity is kept per barcode.
+    
+    Units exported by more than one file are counted once. Unit rows are compared by a
+    hash of every column but 'Ord.'; identical rows within one file are distinct units
+    (same article, date and location), so each row content counts as many times as it
+    appears in the file where it appears most.
+    
+    Args:
+        sources (list): Paths, raw bytes or binary buffers of the CSV files.
+        chunksize (int): Rows per chunk when reading each file (see process_csv_to_dataframe).
+                         Every column is needed for the row hash, so memory then depends on
+                         the distinct unit rows rather than on the rows read.
+        workers (int): Worker processes (None = one per file, up to one per CPU; 1 = sequential).
+        
+    Returns:
+        pd.DataFrame: Same layout as process_csv_to_dataframe. `attrs['encoding']` and
+                      `attrs['date_format']` list the values detected in the files;
+                      `attrs['files']` and `attrs['duplicate_rows']` (unit rows dropped as
+                      duplicates) describe the combination.
+    """
+    result, _ = _process_files(sources, chunksize, workers, codes=None)
+    return result
+
+def process_csv_files_against_codes(sources, codes, chunksize=None, workers=None):
+    """
+    process_csv_against_codes for several robot exports (see process_csv_files_to_dataframe):
+    only the dates of the barcodes in `codes` are parsed, and the robot-only units are
+    counted after removing the duplicates.
+    
+    Returns:
+        tuple: (aggregate restricted to `codes`, robot-only barcodes), as in process_csv_against_codes.
+    """
+    codes = pd.Index(pd.Series(list(codes), dtype=str).str.strip()).unique()
+    result, robot_only = _process_files(sources, chunksize, workers, codes)
+
+    robot_only = robot_only.rename_axis('Código de barras').rename('unidades robot').sort_index().reset_index()
+    return result, robot_only
+
 if __name__ == "__main__":
     # Test with the specific file mentioned
     csv_file = "20260115_150433.Manutenção de stock.csv"
@@ -1,76 +1,183 @@
 import pandas as pd
 import numpy as np
 
-def merge_stock_data(df_pdf, df_csv):
+from instrumentation import stage
+
+# Categories of the compact status column (see stock_status_category)
+STATUS_OK = "ok"
+STATUS_EXCESS = "excesso"
+STATUS_MISSING = "fora do robot"
+STATUS_CATEGORIES = [STATUS_OK, STATUS_EXCESS, STATUS_MISSING]
+
+def calculate_stock_status(sifarma, robot):
     """
-    Merges the PDF dataframe (Sifarma) with the CSV dataframe (Robot).
+    Computes the 'Stock errado' message for every row, vectorized.
     
     Args:
-        df_pdf (pd.DataFrame): Data from PDF (columns: Ord., Código, Designação, Stock, Validade)
-        df_csv (pd.DataFrame): Data from CSV (columns: Código de barras, stock robot, validade robot)
+        sifarma (pd.Series): Sifarma stock per row.
+        robot (pd.Series): Robot stock per row.
         
     Returns:
-        pd.DataFrame: Merged and analyzed dataframe.
+        np.ndarray: Object array with "", "Stock em excesso" or "X emb fora do Robot".
     """
+    missing = (sifarma - robot).abs().astype(str) + " emb fora do Robot"
     
-    # 1. Prepare Join Keys (Ensure string format and strip whitespace)
-    # Using .copy() to avoid SettingWithCopyWarning on the original dfs
-    left_df = df_pdf.copy()
-    right_df = df_csv.copy()
-    
-    left_df['Código'] = left_df['Código'].astype(str).str.strip()
-    right_df['Código de barras'] = right_df['Código de barras'].astype(str).str.strip()
-    
-    # 2. Merge (Left Join on PDF codes)
-    # We use left join because the PDF is the "Control List" (Lista de Controlo)
-    merged = pd.merge(
-        left_df,
-        right_df,
-        left_on='Código',
-        right_on='Código de barras',
-        how='left'
+    return np.select(
+        [sifarma == robot, sifarma < robot],
+        ["", "Stock em excesso"],
+        default=missing.to_numpy(dtype=object)
     )
+
+def stock_status_category(sifarma, robot):
+    """
+    Compact form of the 'Stock errado' column: one categorical value per row instead
+    of a message string. The message can be rebuilt with calculate_stock_status.
     
-    # 3. Clean up and Rename Columns
-    # Fill NaN values for Stock Robot with 0 (if product not in CSV, robot has 0)
-    merged['stock robot'] = merged['stock robot'].fillna(0).astype(int)
-    
-    # Rename columns to target structure
-    column_mapping = {
-        'Ord.': 'Ord.',
-        'Código': 'Codigo',
-        'Designação': 'Designacao',
-        'Stock': 'Stock', # Sifarma Stock
-        'stock robot': 'Stock Robot',
-        'Validade': 'Validade Sifarma',
-        'validade robot': 'Validade Real'
-    }
+    Args:
+        sifarma (pd.Series): Sifarma stock per row.
+        robot (pd.Series): Robot stock per row.
+        
+    Returns:
+        pd.Categorical: STATUS_OK, STATUS_EXCESS or STATUS_MISSING per row.
+    """
+    codes = np.select([sifarma == robot, sifarma < robot], [0, 1], default=2).astype(np.int8)
+    return pd.Categorical.from_codes(codes, categories=STATUS_CATEGORIES)
+
+class RobotIndex:
+    """
+    Robot aggregate indexed by normalized (stripped) barcode.
+
+    Building it normalizes the CSV codes once; merge_stock_data then joins any number
+    of Sifarma lists against it by index lookup, so the same index can be reused for
+    repeated merges against one robot file.
+
+    Args:
+        df_csv (pd.DataFrame): Data from CSV (columns: Código de barras, stock robot, validade robot)
+    """
+
+    def __init__(self, df_csv):
+        codes = df_csv['Código de barras'].astype(str).str.strip().reset_index(drop=True)
+        stock = df_csv['stock robot'].fillna(0).astype(int).reset_index(drop=True)
+        validity = df_csv['validade robot'].reset_index(drop=True)
+
+        index = pd.Index(codes)
+        if not index.is_unique:
+            # Barcodes that only differ in whitespace: sum their units and keep the earliest validity
+            months = pd.to_datetime(validity, format='%m-%Y', errors='coerce')
+            stock = stock.groupby(codes).sum()
+            # Row of each code's earliest valid month; codes without one get no validity (-1)
+            dated = months.notna().to_numpy()
+            earliest = pd.Series(np.flatnonzero(dated), index=codes[dated].to_numpy())
+            earliest = earliest.iloc[np.argsort(months[dated].to_numpy(), kind='stable')]
+            earliest = earliest[~earliest.index.duplicated()]
+            rows = earliest.reindex(stock.index, fill_value=-1).to_numpy()
+            validity = pd.Series(validity.array.take(rows, allow_fill=True))
+            index = pd.Index(stock.index)
+
+        self.index = index
+        # One extra slot (0 units) for codes that are not in the robot
+        self._stock = np.append(stock.to_numpy(), 0)
+        self.validity = validity.array
+
+    def __len__(self):
+        return len(self.index)
+
+    def positions(self, codes):
+        """Position of each normalized code in the index, -1 when the robot does not have it."""
+        return self.index.get_indexer(codes)
+
+    def stock(self, positions):
+        """Robot units for each position (0 for -1)."""
+        return self._stock[positions]
+
+    def validity_at(self, positions):
+        """Robot validity for each position (missing for -1)."""
+        return self.validity.take(positions, allow_fill=True)
+
+def merge_stock_data(df_pdf, df_csv):
+    """
+    Merges the PDF dataframe (Sifarma) with the CSV dataframe (Robot).
+
+    Every Sifarma line is kept (left join on the code). When a code appears on several
+    Sifarma lines (e.g. one per validity), the robot stock is allocated across them in
+    list order: each line takes up to its own Sifarma stock, and any excess goes to the
+    last line, so the units are not counted once per line.
     
-    merged.rename(columns=column_mapping, inplace=True)
+    Args:
+        df_pdf (pd.DataFrame): Data from PDF (columns: Ord., Código, Designação, Stock, Validade)
+        df_csv (pd.DataFrame | RobotIndex): Data from CSV (columns: Código de barras, stock robot,
+                                            validade robot), or a RobotIndex built from it.
+        
+    Returns:
+        pd.DataFrame: Merged and analyzed dataframe.
+    """
+    with stage('merge', rows_in=len(df_pdf), csv_rows=len(df_csv)) as record:
+        robot = df_csv if isinstance(df_csv, RobotIndex) else RobotIndex(df_csv)
+        result = _merge_stock_data(df_pdf, robot)
+        record['rows_out'] = len(result)
+    return result
+
+def allocate_robot_stock(groups, sifarma, robot):
+    """
+    Splits the robot stock of codes listed on several Sifarma lines across those lines.
+
+    Lines are filled in order up to their Sifarma stock; what is left after the last
+    line is added to it.
     
+    Args:
+        groups (np.ndarray): Code (or robot index position) of each line.
+        sifarma (np.ndarray): Sifarma stock per line.
+        robot (np.ndarray): Total robot stock of the line's code (repeated on each line).
+        
+    Returns:
+        np.ndarray: Robot stock allocated to each line.
+    """
+    filled_before = pd.Series(sifarma).groupby(groups).cumsum().to_numpy() - sifarma
+    allocated = np.clip(robot - filled_before, 0, sifarma)
+
+    last = ~pd.Series(groups).duplicated(keep='last').to_numpy()
+    allocated_total = pd.Series(allocated).groupby(groups).transform('sum').to_numpy()
+    allocated[last] += robot[last] - allocated_total[last]
+    return allocated
+
+def _merge_stock_data(df_pdf, robot):
+    """Index join and status computation behind merge_stock_data."""
+    # 1. Normalize the Sifarma codes and look them up in the robot index
+    codes = df_pdf['Código'].astype(str).str.strip()
+    positions = robot.positions(codes)
+    found = positions >= 0
+
+    stock_robot = robot.stock(positions)
+    sifarma = df_pdf['Stock'].to_numpy()
+
+    # 2. Codes listed on several Sifarma lines share the robot stock instead of repeating it
+    # Slot 0 counts the codes missing from the robot
+    lines_per_code = np.bincount(positions + 1, minlength=len(robot) + 1)
+    repeated = found & (lines_per_code[positions + 1] > 1)
+    if repeated.any():
+        stock_robot[repeated] = allocate_robot_stock(positions[repeated], sifarma[repeated], stock_robot[repeated])
+
+    # 3. Build the result with the target column names
+    merged = pd.DataFrame(index=pd.RangeIndex(len(df_pdf)))
+    if 'Ord.' in df_pdf.columns:
+        merged['Ord.'] = df_pdf['Ord.'].array
+    merged['Codigo'] = codes.array
+    if 'Designação' in df_pdf.columns:
+        merged['Designacao'] = df_pdf['Designação'].array
+    merged['Stock'] = df_pdf['Stock'].array
+    merged['Stock Robot'] = stock_robot.astype(int)
+    if 'Validade' in df_pdf.columns:
+        merged['Validade Sifarma'] = df_pdf['Validade'].array
+    merged['Validade Real'] = robot.validity_at(positions)
+
     # 4. Calculate 'Stock errado' column based on user logic
     # Logic: 
-    # If Stock < Stock Robot -> "X caixas fora do robot"
-    # If Stock > Stock Robot -> "Stock em excesso"
+    # If Stock < Stock Robot -> "Stock em excesso"
+    # If Stock > Stock Robot -> "X emb fora do Robot"
     # Else (Equal) -> "" (Empty)
+    merged['Stock errado'] = calculate_stock_status(merged['Stock'], merged['Stock Robot'])
     
-    def calculate_stock_status(row):
-        sifarma = row['Stock']
-        robot = row['Stock Robot']
-        
-        diff = abs(sifarma - robot)
-        
-        if sifarma == robot:
-            return ""
-        elif sifarma < robot:
-            return "Stock em excesso"
-        else: # sifarma > robot
-            return f"{diff} emb fora do Robot"
-
-    merged['Stock errado'] = merged.apply(calculate_stock_status, axis=1)
-    
-    # 5. Select Final Columns
-    # Handle the case where 'Ord.' might be an index in df_pdf
+    # 5. Handle the case where 'Ord.' might be an index in df_pdf
     if 'Ord.' not in merged.columns and 'Ord.' in df_pdf.index.names:
         merged['Ord.'] = merged.index
         
@@ -85,7 +192,6 @@ def merge_stock_data(df_pdf, df_csv):
         'Stock errado'
     ]
     
-    # Ensure Ord. exists if it was preserved from left join or index
     cols_to_keep = [c for c in final_columns if c in merged.columns]
     
     return merged[cols_to_keep]
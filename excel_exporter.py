@@ -0,0 +1,78 @@
+from io import BytesIO
+
+import pandas as pd
+
+from instrumentation import stage
+
+SHEET_NAME = 'Analise_Stock'
+# A partir deste número de linhas o modo de escrita em streaming é usado por omissão
+STREAMING_MIN_ROWS = 50000
+# Linhas escritas entre atualizações do progresso no modo de streaming
+PROGRESS_EVERY_ROWS = 5000
+
+def generate_excel(df, streaming=None, progress=None):
+    """
+    Gera o ficheiro Excel (.xlsx) com o resultado da análise.
+
+    Args:
+        df (pd.DataFrame): Resultado de merge_stock_data.
+        streaming (bool): Usa o modo write-only do openpyxl, que escreve as linhas diretamente
+                          para o ficheiro em vez de manter o livro inteiro em memória.
+                          Por omissão é ativado a partir de STREAMING_MIN_ROWS linhas.
+        progress (callable): Recebe a fração já escrita (0 a 1); no modo normal só no fim.
+
+    Returns:
+        BytesIO: Conteúdo do ficheiro .xlsx.
+    """
+    if streaming is None:
+        streaming = len(df) >= STREAMING_MIN_ROWS
+
+    with stage('excel_export', rows_in=len(df), streaming=streaming) as record:
+        buffer = BytesIO()
+        if streaming:
+            _write_streaming(df, buffer, progress)
+        else:
+            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+                df.to_excel(writer, index=False, sheet_name=SHEET_NAME)
+        buffer.seek(0)
+        record['rows_out'] = len(df)
+        record['bytes'] = buffer.getbuffer().nbytes
+    if progress is not None:
+        progress(1.0)
+    return buffer
+
+def _excel_value(value):
+    """Converte valores pandas/numpy para tipos que o openpyxl escreve (NaN -> célula vazia)."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+def _write_streaming(df, buffer, progress=None):
+    """Escreve o DataFrame linha a linha com um Workbook write-only (memória constante)."""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(SHEET_NAME)
+
+    # Cabeçalho com o mesmo formato do pandas.to_excel (negrito, centrado, com contorno)
+    thin = Side(style='thin')
+    header = []
+    for column in df.columns:
+        cell = WriteOnlyCell(sheet, value=str(column))
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center', vertical='top')
+        cell.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+        header.append(cell)
+    sheet.append(header)
+
+    for i, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        sheet.append([_excel_value(v) for v in row])
+        if progress is not None and i % PROGRESS_EVERY_ROWS == 0:
+            # Guardar o livro ainda leva algum tempo depois da última linha
+            progress(0.95 * i / len(df))
+
+    workbook.save(buffer)
@@ -0,0 +1,394 @@
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from data_merger import STATUS_EXCESS, STATUS_MISSING, STATUS_OK, stock_status_category
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    store TEXT NOT NULL,
+    run_date TEXT NOT NULL,
+    created TEXT NOT NULL,
+    pdf_key TEXT NOT NULL,
+    csv_key TEXT NOT NULL,
+    items INTEGER NOT NULL,
+    divergences INTEGER NOT NULL,
+    missing_lines INTEGER NOT NULL,
+    excess_lines INTEGER NOT NULL,
+    missing_units INTEGER NOT NULL,
+    UNIQUE (store, pdf_key, csv_key)
+);
+CREATE TABLE IF NOT EXISTS items (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    store TEXT NOT NULL,
+    run_date TEXT NOT NULL,
+    ord INTEGER,
+    code TEXT NOT NULL,
+    description TEXT,
+    stock INTEGER NOT NULL,
+    stock_robot INTEGER NOT NULL,
+    validity TEXT,
+    validity_robot TEXT,
+    status TEXT NOT NULL,
+    missing INTEGER NOT NULL
+);
+-- Running totals per product, updated with each run, so trend queries do not scan 'items'
+CREATE TABLE IF NOT EXISTS products (
+    store TEXT NOT NULL,
+    code TEXT NOT NULL,
+    description TEXT,
+    runs INTEGER NOT NULL,
+    runs_missing INTEGER NOT NULL,
+    missing_units INTEGER NOT NULL,
+    first_run TEXT NOT NULL,
+    last_run TEXT NOT NULL,
+    last_missing TEXT,
+    PRIMARY KEY (store, code)
+);
+CREATE INDEX IF NOT EXISTS idx_items_code ON items (code, run_date);
+CREATE INDEX IF NOT EXISTS idx_items_run_date ON items (run_date);
+CREATE INDEX IF NOT EXISTS idx_items_status ON items (status, run_date);
+CREATE INDEX IF NOT EXISTS idx_runs_store_date ON runs (store, run_date);
+"""
+
+# Robot CSV exports are named like '20260115_150433.Manutenção de stock.csv'
+_DATE_PREFIX = re.compile(r'(\d{4})[-_]?(\d{2})[-_]?(\d{2})')
+
+
+def _month_first(validity):
+    """'MM-YYYY' -> 'YYYY-MM', so validities sort and group as text."""
+    validity = validity.astype('string')
+    return validity.str[3:] + '-' + validity.str[:2]
+
+
+class HistoryDB:
+    """
+    SQLite history of reconciliation runs: one 'runs' row per run and one 'items' row
+    per Sifarma line, indexed by code, run date and status. Per-run counts (in 'runs')
+    and per-product running totals (in 'products') are kept up to date on insert, so the
+    trend queries read a few thousand rows at most.
+
+    A connection is opened per call, so one instance can be shared between threads.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def query(self, sql, params=()):
+        """Runs a read query and returns a DataFrame."""
+        with closing(self._connect()) as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def has_run(self, store, pdf_key, csv_key):
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM runs WHERE store = ? AND pdf_key = ? AND csv_key = ?", (store, pdf_key, csv_key)
+            ).fetchone()
+        return row is not None
+
+    def record_run(self, store, run_date, merged, pdf_key, csv_key):
+        """
+        Appends a merge_stock_data result. A run with the same store and files is only stored once.
+
+        Args:
+            store (str): Store (pharmacy) name.
+            run_date (date | str): Date of the run (ISO 'YYYY-MM-DD' if a string).
+            merged (pd.DataFrame): Output of merge_stock_data.
+            pdf_key, csv_key (str): Identity of the two files (e.g. ParseCache.make_key).
+
+        Returns:
+            int | None: Id of the new run, or None if it was already recorded.
+        """
+        run_date = run_date.isoformat() if isinstance(run_date, date) else str(run_date)
+        status = stock_status_category(merged['Stock'], merged['Stock Robot'])
+        n = len(merged)
+        missing = (merged['Stock'] - merged['Stock Robot']).clip(lower=0).astype(int)
+        codes = merged['Codigo'].astype(str)
+        descriptions = merged['Designacao'] if 'Designacao' in merged.columns else pd.Series([None] * n, index=merged.index)
+        columns = [
+            pd.to_numeric(merged['Ord.'], errors='coerce') if 'Ord.' in merged.columns else pd.Series([None] * n),
+            codes,
+            descriptions,
+            merged['Stock'].astype(int),
+            merged['Stock Robot'].astype(int),
+            _month_first(merged['Validade Sifarma']) if 'Validade Sifarma' in merged.columns else pd.Series([None] * n),
+            _month_first(merged['Validade Real']),
+            pd.Series(np.asarray(status, dtype=object)),
+            missing,
+        ]
+        # Plain Python values (NaN -> NULL) for sqlite3
+        columns = [c.astype(object).where(c.notna(), None).tolist() for c in columns]
+
+        # One totals row per product (codes can be on several lines)
+        per_code = pd.DataFrame({'code': codes.to_numpy(), 'description': descriptions.to_numpy(),
+                                 'missing': missing.to_numpy(), 'is_missing': (status == STATUS_MISSING)})
+        per_code = per_code.groupby('code', sort=False).agg(
+            description=('description', 'first'), missing=('missing', 'sum'), is_missing=('is_missing', 'any'))
+        product_rows = [
+            (store, code, description, int(is_missing), int(units), run_date, run_date, run_date if is_missing else None)
+            for code, description, units, is_missing in per_code.itertuples(name=None)
+        ]
+
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO runs (store, run_date, created, pdf_key, csv_key, items, divergences, "
+                "missing_lines, excess_lines, missing_units) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (store, run_date, datetime.now().isoformat(timespec='seconds'), pdf_key, csv_key, n,
+                 int((status != STATUS_OK).sum()), int((status == STATUS_MISSING).sum()),
+                 int((status == STATUS_EXCESS).sum()), int(missing.sum()))
+            )
+            if cursor.rowcount == 0:
+                return None
+            run_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO items (run_id, store, run_date, ord, code, description, stock, stock_robot, "
+                "validity, validity_robot, status, missing) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                zip([run_id] * n, [store] * n, [run_date] * n, *columns)
+            )
+            conn.executemany(
+                "INSERT INTO products (store, code, description, runs, runs_missing, missing_units, "
+                "first_run, last_run, last_missing) VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (store, code) DO UPDATE SET "
+                "description = COALESCE(excluded.description, description), "
+                "runs = runs + 1, "
+                "runs_missing = runs_missing + excluded.runs_missing, "
+                "missing_units = missing_units + excluded.missing_units, "
+                "first_run = MIN(first_run, excluded.first_run), "
+                "last_run = MAX(last_run, excluded.last_run), "
+                "last_missing = COALESCE(MAX(last_missing, excluded.last_missing), last_missing, excluded.last_missing)",
+                product_rows
+            )
+        return run_id
+
+    def runs(self, store=None):
+        """Recorded runs, latest first."""
+        sql = "SELECT id, store, run_date, items, divergences, created FROM runs"
+        params = ()
+        if store:
+            sql += " WHERE store = ?"
+            params = (store,)
+        return self.query(sql + " ORDER BY run_date DESC, id DESC", params)
+
+    def stores(self):
+        return self.query("SELECT DISTINCT store FROM runs ORDER BY store")['store'].tolist()
+
+    def chronic_missing(self, store=None, since=None, min_runs=2, limit=100):
+        """
+        Products most often out of the robot: per code, the runs in which it was listed,
+        the runs in which it had units outside the robot, and the units missing in total.
+
+        Read from the per-product totals; with `since` (a run date) the lines of those
+        runs are aggregated instead, which is slower on a long history.
+
+        Returns:
+            pd.DataFrame: Sorted by the share of runs with units outside the robot.
+        """
+        if since is None:
+            where, params = "", []
+            if store:
+                where = "WHERE store = ?"
+                params.append(store)
+            sql = f"""
+                SELECT code AS Codigo,
+                       MAX(description) AS Designacao,
+                       SUM(runs) AS execucoes,
+                       SUM(runs_missing) AS execucoes_fora,
+                       SUM(missing_units) AS emb_fora_total,
+                       MAX(last_missing) AS ultima_vez_fora
+                FROM products {where}
+                GROUP BY code
+                HAVING execucoes_fora >= ?
+                ORDER BY 1.0 * execucoes_fora / execucoes DESC, execucoes_fora DESC, emb_fora_total DESC
+                LIMIT ?
+            """
+            return self.query(sql, [*params, min_runs, limit])
+
+        where, params = ["run_date >= ?"], [str(since)]
+        if store:
+            where.append("store = ?")
+            params.append(store)
+        sql = f"""
+            SELECT code AS Codigo,
+                   MAX(description) AS Designacao,
+                   COUNT(DISTINCT run_id) AS execucoes,
+                   COUNT(DISTINCT CASE WHEN status = ? THEN run_id END) AS execucoes_fora,
+                   SUM(missing) AS emb_fora_total,
+                   MAX(CASE WHEN status = ? THEN run_date END) AS ultima_vez_fora
+            FROM items
+            WHERE {' AND '.join(where)}
+            GROUP BY code
+            HAVING execucoes_fora >= ?
+            ORDER BY 1.0 * execucoes_fora / execucoes DESC, execucoes_fora DESC, emb_fora_total DESC
+            LIMIT ?
+        """
+        return self.query(sql, [STATUS_MISSING, STATUS_MISSING, *params, min_runs, limit])
+
+    def product_history(self, code, store=None):
+        """Every recorded line of one product, by run date."""
+        sql = """
+            SELECT run_date AS Data, store AS Loja, description AS Designacao, stock AS Stock,
+                   stock_robot AS "Stock Robot", validity AS "Validade Sifarma",
+                   validity_robot AS "Validade Real", status AS Estado
+            FROM items WHERE code = ?
+        """
+        params = [str(code).strip()]
+        if store:
+            sql += " AND store = ?"
+            params.append(store)
+        return self.query(sql + " ORDER BY run_date, ord", params)
+
+    def monthly_trend(self, store=None):
+        """Per month: runs, lines, lines with units outside the robot / in excess, and units missing."""
+        where, params = "", []
+        if store:
+            where = "WHERE store = ?"
+            params.append(store)
+        sql = f"""
+            SELECT substr(run_date, 1, 7) AS Mes,
+                   COUNT(*) AS execucoes,
+                   SUM(items) AS linhas,
+                   SUM(missing_lines) AS fora_do_robot,
+                   SUM(excess_lines) AS stock_em_excesso,
+                   SUM(missing_units) AS emb_fora
+            FROM runs {where}
+            GROUP BY Mes ORDER BY Mes
+        """
+        return self.query(sql, params)
+
+
+def run_date_for(csv_path, run_dir=None):
+    """
+    Date of an archived run: the date prefix of the robot CSV name (e.g. '20260115_150433...'),
+    else a date in the run directory name, else the CSV modification date.
+    """
+    for name in (os.path.basename(csv_path), os.path.basename(os.path.normpath(run_dir or ''))):
+        match = _DATE_PREFIX.match(name)
+        if match:
+            try:
+                return date(*(int(part) for part in match.groups()))
+            except ValueError:
+                pass
+    return date.fromtimestamp(os.path.getmtime(csv_path))
+
+
+def _reconcile_archived(run_name, pdf_path, csv_path):
+    """Worker: parses and merges one archived pair. Returns (run name, date, keys, merged)."""
+    from csv_processor import PARSER_VERSION as CSV_PARSER_VERSION
+    from parse_cache import ParseCache
+    from pdf_processor import PARSER_VERSION as PDF_PARSER_VERSION
+    from pipeline import reconcile_files
+
+    with open(pdf_path, 'rb') as f:
+        pdf_data = f.read()
+    with open(csv_path, 'rb') as f:
+        csv_data = f.read()
+
+    *_, merged = reconcile_files(pdf_data, [csv_data])
+    return (run_name, run_date_for(csv_path, os.path.dirname(csv_path)),
+            ParseCache.make_key('pdf', pdf_data, PDF_PARSER_VERSION),
+            ParseCache.make_key('csv', csv_data, CSV_PARSER_VERSION), merged)
+
+
+def backfill(db, store, runs, workers=None, progress=print):
+    """
+    Imports archived runs into the history: the pairs are parsed and merged in a process
+    pool, and the results are written from this process (SQLite has a single writer).
+
+    Args:
+        db (HistoryDB): Target database.
+        store (str): Store the runs belong to.
+        runs (list): (run name, pdf_path, csv_path) tuples, e.g. from batch_cli.discover_stores.
+        workers (int): Worker processes (None = one per CPU).
+        progress (callable): Receives one line of text per finished run.
+
+    Returns:
+        tuple: (runs imported, runs already present, runs failed).
+    """
+    imported = skipped = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_reconcile_archived, name, pdf_path, csv_path): name
+            for name, pdf_path, csv_path in runs
+            if pdf_path is not None and csv_path is not None
+        }
+        for name, pdf_path, csv_path in runs:
+            if pdf_path is None or csv_path is None:
+                failed += 1
+                progress(f"{name}: erro (é preciso exatamente um PDF e um CSV)")
+        for done, future in enumerate(as_completed(futures), start=1):
+            name = futures[future]
+            try:
+                _, run_date, pdf_key, csv_key, merged = future.result()
+                run_id = db.record_run(store, run_date, merged, pdf_key, csv_key)
+            except Exception as e:
+                failed += 1
+                progress(f"[{done}/{len(futures)}] {name}: erro ({type(e).__name__}: {e})")
+                continue
+            if run_id is None:
+                skipped += 1
+                progress(f"[{done}/{len(futures)}] {name}: já importado")
+            else:
+                imported += 1
+                progress(f"[{done}/{len(futures)}] {name}: {run_date.isoformat()}, {len(merged)} linhas")
+    return imported, skipped, failed
+
+
+if __name__ == "__main__":
+    from batch_cli import discover_stores, read_manifest
+
+    parser = argparse.ArgumentParser(description="History of reconciliation runs (SQLite).")
+    parser.add_argument("--db", default="historico.sqlite", help="History database (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="Backfill the history from archived PDF/CSV pairs")
+    source = import_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-dir", help="Directory with one sub-directory (PDF + CSV) per archived run")
+    source.add_argument("--manifest", help="';'-separated CSV with columns loja;pdf;csv (one line per run)")
+    import_parser.add_argument("--store", required=True, help="Store the runs belong to")
+    import_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+
+    chronic_parser = commands.add_parser("chronic", help="Products most often out of the robot")
+    chronic_parser.add_argument("--store", default=None)
+    chronic_parser.add_argument("--since", default=None, help="First run date (YYYY-MM-DD)")
+    chronic_parser.add_argument("--min-runs", type=int, default=2)
+
+    trend_parser = commands.add_parser("trend", help="Divergences per month")
+    trend_parser.add_argument("--store", default=None)
+
+    args = parser.parse_args()
+    db = HistoryDB(args.db)
+
+    if args.command == "import":
+        runs = discover_stores(args.input_dir) if args.input_dir else read_manifest(args.manifest)
+        if not runs:
+            print("No runs found.")
+            sys.exit(1)
+        imported, skipped, failed = backfill(db, args.store, runs, workers=args.workers)
+        print(f"Done: {imported} imported, {skipped} already present, {failed} failed.")
+        sys.exit(1 if failed else 0)
+
+    start = time.perf_counter()
+    if args.command == "chronic":
+        result = db.chronic_missing(store=args.store, since=args.since, min_runs=args.min_runs)
+    else:
+        result = db.monthly_trend(store=args.store)
+    print(result.to_string(index=False))
+    print(f"({(time.perf_counter() - start) * 1000:.1f} ms)")
@@ -0,0 +1,112 @@
+import contextvars
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger("robot_validades.perf")
+
+# Records of the stages run inside the active collect() block (None = not collecting)
+_collector = contextvars.ContextVar("stage_collector", default=None)
+# Stages currently open in this context, innermost last
+_open_stages = contextvars.ContextVar("open_stages", default=())
+
+_MB = 1024 * 1024
+
+def configure_logging(stream=None, level=logging.INFO):
+    """
+    Sends the stage records to `stream` (stderr by default) as one JSON object per line.
+    Calling it again is a no-op, so every entry point can call it.
+    """
+    if any(getattr(h, "_robot_perf", False) for h in logger.handlers):
+        return
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    handler._robot_perf = True
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+def enable_memory_tracking(enabled=True):
+    """
+    Starts (or stops) tracemalloc so stages report their peak memory.
+    Tracing makes Python allocations noticeably slower, so it is off by default.
+    """
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+@contextmanager
+def collect():
+    """
+    Collects the records of every stage run inside the block (in this thread/context).
+
+    Yields:
+        list: Stage records, appended as each stage finishes.
+    """
+    records = []
+    token = _collector.set(records)
+    try:
+        yield records
+    finally:
+        _collector.reset(token)
+
+def add_records(records):
+    """Appends stage records measured elsewhere (e.g. in a worker thread) to the active collect() list, if any."""
+    collected = _collector.get()
+    if collected is not None:
+        collected.extend(records)
+
+@contextmanager
+def stage(name, rows_in=None, **extra):
+    """
+    Measures one pipeline stage: wall time, rows in/out and, when memory tracking is
+    enabled, the peak memory allocated above the level at which the stage started.
+
+    The yielded record is a dict; the stage sets 'rows_out' (and may add 'rows_in'
+    or other fields) before the block ends. On exit it is logged as a JSON line and
+    appended to the active collect() list, if any.
+    """
+    record = {"stage": name, "rows_in": rows_in, "rows_out": None, **extra}
+    tracing = tracemalloc.is_tracing()
+    parents = _open_stages.get()
+
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        # Keep the parents' peak before resetting the counter for this stage
+        for parent in parents:
+            parent["_peak"] = max(parent.get("_peak", 0), peak)
+        tracemalloc.reset_peak()
+        record["_start_mem"] = current
+
+    token = _open_stages.set(parents + (record,))
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["wall_s"] = round(time.perf_counter() - start, 6)
+        _open_stages.reset(token)
+
+        start_mem = record.pop("_start_mem", None)
+        stage_peak = record.pop("_peak", 0)
+        if tracing and tracemalloc.is_tracing():
+            peak = max(stage_peak, tracemalloc.get_traced_memory()[1])
+            for parent in parents:
+                parent["_peak"] = max(parent.get("_peak", 0), peak)
+            record["peak_mb"] = round((peak - start_mem) / _MB, 3)
+        else:
+            record["peak_mb"] = None
+
+        records = _collector.get()
+        if records is not None:
+            records.append(record)
+        logger.info(json.dumps({"event": "stage", **record}, ensure_ascii=False, default=str))
+
+def count(field, n=1):
+    """Adds `n` to `field` (e.g. 'rows_in', 'pages') of the innermost open stage, if any."""
+    parents = _open_stages.get()
+    if parents:
+        parents[-1][field] = (parents[-1].get(field) or 0) + n
@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+
+class PageCache:
+    """
+    Parsed rows of single PDF pages, keyed by a hash of each page's content stream (see
+    pdf_processor.page_keys), so a re-exported list with a few corrected pages only has
+    those pages extracted and matched again.
+
+    Values are the (orphans, rows) tuples of the page parsers. They are copied in and
+    out, since stitching the pages appends continuation lines to the row dicts. The
+    least recently used pages are dropped beyond `max_pages`. All methods are safe to
+    call from several threads.
+    """
+
+    def __init__(self, max_pages=5000):
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pages)
+
+    def get(self, key):
+        """Returns a copy of the page result stored under `key` (counting a hit or a miss), or None."""
+        with self._lock:
+            value = self._pages.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+        return _copy_result(value)
+
+    def put(self, key, value):
+        value = _copy_result(value)
+        with self._lock:
+            self._pages[key] = value
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: pages, max_pages, hits, misses and hit_rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'pages': len(self._pages),
+                'max_pages': self.max_pages,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+def _copy_result(value):
+    """Copy of an (orphans, rows) page result; the row values themselves are immutable."""
+    orphans, rows = value
+    return list(orphans), [dict(row) for row in rows]
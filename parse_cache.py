@@ -0,0 +1,98 @@
+import hashlib
+import os
+import threading
+
+from result_store import ResultStore
+
+
+def content_hash(data):
+    """
+    Returns the SHA-256 hex digest of the raw file bytes.
+
+    Args:
+        data (bytes): Uploaded file content.
+
+    Returns:
+        str: Hex digest used as the cache identity of the file.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class ParseCache:
+    """
+    Cache of parsed DataFrames keyed by file content and parser version.
+
+    The first tier is an in-memory LRU capped at `max_entries` (or a shared
+    ResultStore passed as `store`, with its own budget). The optional second tier
+    stores each DataFrame as a Parquet file in `disk_dir`, so a restarted app can
+    reuse previous parses.
+
+    Cached DataFrames are shared between callers and must not be modified in place.
+    """
+
+    def __init__(self, max_entries=16, disk_dir=None, store=None):
+        if disk_dir:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ImportError("The 'pyarrow' library is required for the on-disk parse cache. Please install it with: pip install pyarrow")
+            os.makedirs(disk_dir, exist_ok=True)
+
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.store = store if store is not None else ResultStore(max_bytes=None, max_entries=max_entries)
+
+    @staticmethod
+    def make_key(kind, data, version):
+        """Builds the cache key for a file: '<kind>-v<version>-<sha256>'."""
+        return f"{kind}-v{version}-{content_hash(data)}"
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.parquet")
+
+    def get(self, key):
+        """Returns the cached DataFrame for `key`, or None if it is not cached."""
+        df = self.store.get(key)
+        if df is not None:
+            return df
+
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            import pandas as pd
+            df = pd.read_parquet(self._disk_path(key))
+            self.store.put(key, df)
+            return df
+
+        return None
+
+    def put(self, key, df):
+        """Stores a DataFrame in memory and, if enabled, on disk."""
+        self.store.put(key, df)
+
+        if self.disk_dir:
+            # Write to a temporary name first so a concurrent reader never sees a partial file
+            tmp_path = self._disk_path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+            df.to_parquet(tmp_path)
+            os.replace(tmp_path, self._disk_path(key))
+
+    def get_or_parse(self, kind, data, version, parser):
+        """
+        Returns the cached parse of `data`, calling `parser()` only on a miss.
+
+        Args:
+            kind (str): File type, e.g. 'pdf' or 'csv'.
+            data (bytes): Raw file content.
+            version (int): Parser version; bump it when the parser output changes.
+            parser (callable): Zero-argument function producing the DataFrame.
+
+        Returns:
+            pd.DataFrame: Parsed (possibly cached) DataFrame.
+        """
+        return self.load(self.make_key(kind, data, version), parser)
+
+    def load(self, key, parser):
+        """Returns the DataFrame cached under `key` (see make_key), calling `parser()` only on a miss."""
+        df = self.get(key)
+        if df is None:
+            df = parser()
+            self.put(key, df)
+        return df
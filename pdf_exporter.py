@@ -1,15 +1,61 @@
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4, portrait
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, BaseDocTemplate, PageTemplate, Frame, NextPageTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from io import BytesIO
 from datetime import datetime
 
-def generate_pdf(df):
+from instrumentation import stage
+
+# A partir deste número de linhas o modo rápido é usado por omissão
+FAST_MODE_MIN_ROWS = 1000
+# Linhas por tabela no modo rápido (cada bloco é partido entre páginas de forma barata)
+FAST_MODE_CHUNK_ROWS = 100
+
+def generate_pdf(df, fast=None, progress=None):
     """
     Gera um PDF formatado (Vertical A4) similar ao original do Sifarma.
+
+    Args:
+        df (pd.DataFrame): Resultado de merge_stock_data.
+        fast (bool): Usa o modo rápido para relatórios grandes (estilos partilhados, texto simples
+                     nas colunas numéricas curtas e tabela emitida em blocos). Por omissão é
+                     ativado a partir de FAST_MODE_MIN_ROWS linhas.
+        progress (callable): Recebe a fração já paginada (0 a 1) durante a geração.
     """
+    if fast is None:
+        fast = len(df) >= FAST_MODE_MIN_ROWS
+
+    with stage('pdf_export', rows_in=len(df), fast=fast) as record:
+        if fast:
+            buffer, pages = _generate_pdf_fast(df, progress)
+        else:
+            buffer, pages = _generate_pdf_standard(df, progress)
+        record['rows_out'] = len(df)
+        record['pages'] = pages
+    if progress is not None:
+        progress(1.0)
+    return buffer
+
+def _track_progress(doc, progress):
+    """Passa o progresso do reportlab (elementos paginados / estimativa do total) para `progress`."""
+    if progress is None:
+        return
+    total = [1]
+
+    def on_progress(kind, value):
+        if kind == 'SIZE_EST':
+            total[0] = max(value, 1)
+        elif kind == 'PROGRESS':
+            # A estimativa do reportlab pode ser ultrapassada (tabelas partidas entre páginas)
+            progress(min(value / total[0], 0.99))
+
+    doc.setProgressCallBack(on_progress)
+
+def _generate_pdf_standard(df, progress=None):
+    """Modo normal do generate_pdf: uma única tabela com Paragraph em todas as células."""
     buffer = BytesIO()
     doc = SimpleDocTemplate(
         buffer,
@@ -161,6 +207,205 @@ def generate_pdf(df):
     now_str = datetime.now().strftime('%d-%m-%Y %H:%M:%S')
     elements.append(Paragraph(f"Impressão: {now_str}", footer_style))
     
+    _track_progress(doc, progress)
+    doc.build(elements)
+    buffer.seek(0)
+    return buffer, doc.page
+
+def _column_values(df, column):
+    """Valores de uma coluna convertidos em texto (vazio se a coluna não existir)."""
+    if column not in df.columns:
+        return [''] * len(df)
+    return [str(v) for v in df[column].tolist()]
+
+def _split_long_word(text, width):
+    """Quebra uma palavra em linhas (separadas por '\\n') que cabem na largura dada."""
+    lines = []
+    current = ''
+    for char in text:
+        if current and stringWidth(current + char, 'Helvetica', 7) > width:
+            lines.append(current)
+            current = char
+        else:
+            current += char
+    lines.append(current)
+    return '\n'.join(lines)
+
+def _generate_pdf_fast(df, progress=None):
+    """
+    Modo rápido do generate_pdf, com o mesmo aspeto visual.
+
+    - Dois estilos de célula partilhados (normal e vermelho) em vez de um por linha.
+    - Só as células cujo texto não cabe numa linha usam Paragraph; as restantes (quase
+      todas as colunas numéricas e curtas) são texto simples formatado pelo TableStyle.
+    - A tabela é emitida em blocos de FAST_MODE_CHUNK_ROWS linhas, pelo que o reportlab
+      nunca recalcula a altura de milhares de linhas ao partir a tabela entre páginas.
+      O cabeçalho da tabela nas páginas seguintes é desenhado pelo modelo de página.
+    """
+    buffer = BytesIO()
+    doc = BaseDocTemplate(
+        buffer,
+        pagesize=portrait(A4),
+        rightMargin=1.0*cm,
+        leftMargin=1.0*cm,
+        topMargin=1.0*cm,
+        bottomMargin=1.0*cm
+    )
+
+    styles = getSampleStyleSheet()
+    
+    title_style = ParagraphStyle(
+        'TitleCustom',
+        parent=styles['Heading1'],
+        fontSize=14,
+        alignment=1, # Center
+        spaceAfter=10,
+        textColor=colors.black,
+        fontName='Helvetica-Bold'
+    )
+    
+    subtitle_style = ParagraphStyle(
+        'SubtitleCustom',
+        parent=styles['Normal'],
+        fontSize=9,
+        alignment=1, # Center
+        spaceAfter=20,
+        textColor=colors.black
+    )
+
+    headers = ['Ord.', 'Código', 'Designação', 'Val. Robot', 'Stock', 'Robot', 'Validade', 'Divergência']
+    
+    col_widths = [
+        0.8*cm,  # Ord.
+        1.8*cm,  # Código
+        6.2*cm,  # Designação
+        2.0*cm,  # Val. Robot (No lugar de Lote)
+        1.0*cm,  # Stock
+        1.0*cm,  # Robot (No lugar de Pratel.)
+        2.0*cm,  # Validade
+        4.2*cm   # Divergência (No lugar de Correcção)
+    ]
+    
+    cell_style = ParagraphStyle(
+        'CellStyle',
+        parent=styles['Normal'],
+        fontSize=7,
+        leading=8,
+        alignment=0 # Left
+    )
+    error_cell_style = ParagraphStyle(
+        'CellStyleError',
+        parent=cell_style,
+        textColor=colors.red
+    )
+    
+    header_para_style = ParagraphStyle(
+        'HeaderParaStyle',
+        parent=cell_style,
+        fontName='Helvetica-Bold',
+        fontSize=8,
+        alignment=1 # Center
+    )
+    header_row = [Paragraph(h, header_para_style) for h in headers]
+
+    base_style_cmds = [
+        # Grelha
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+        # Alinhamento
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        # Padding
+        ('TOPPADDING', (0, 0), (-1, -1), 2),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+        # Texto simples com a mesma fonte das células Paragraph
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 7),
+        ('LEADING', (0, 0), (-1, -1), 8),
+    ]
+    header_style_cmds = [
+        ('ALIGN', (0, 0), (-1, 0), 'CENTER'), # Header center
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+    ]
+
+    # --- Modelos de página ---
+    # Primeira página: título e tabela com o seu cabeçalho.
+    # Seguintes: o cabeçalho da tabela é desenhado no topo e a moldura começa por baixo dele.
+    header_table = Table([header_row], colWidths=col_widths)
+    header_table.setStyle(TableStyle(base_style_cmds + header_style_cmds))
+    _, header_height = header_table.wrap(doc.width, doc.height)
+
+    frame_padding = 6 # Padding por omissão da Frame
+    table_x = doc.leftMargin + (doc.width - sum(col_widths)) / 2
+    table_top = doc.bottomMargin + doc.height - frame_padding
+
+    def draw_table_header(canvas, document):
+        header_table.drawOn(canvas, table_x, table_top - header_height)
+
+    first_frame = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height, id='first')
+    later_frame = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height - header_height, id='later')
+    doc.addPageTemplates([
+        PageTemplate(id='Primeira', frames=first_frame, pagesize=doc.pagesize),
+        PageTemplate(id='Seguintes', frames=later_frame, onPage=draw_table_header, pagesize=doc.pagesize),
+    ])
+
+    elements = [NextPageTemplate('Seguintes')]
+    elements.append(Paragraph("Lista de Controlo de Prazos de Validades", title_style))
+    elements.append(Paragraph(f"Relatório Comparativo (Sifarma vs Robot) - Gerado em {datetime.now().strftime('%d-%m-%Y')}", subtitle_style))
+
+    # --- Linhas de Dados ---
+    # Mesma ordem de colunas do modo normal:
+    # Ord | Codigo | Designacao | Validade Real | Stock | Stock Robot | Validade Sifarma | Stock errado
+    columns = [
+        _column_values(df, 'Ord.'),
+        _column_values(df, 'Codigo'),
+        _column_values(df, 'Designacao'),
+        _column_values(df, 'Validade Real'),
+        _column_values(df, 'Stock'),
+        _column_values(df, 'Stock Robot'),
+        _column_values(df, 'Validade Sifarma'),
+        _column_values(df, 'Stock errado'),
+    ]
+    rows = list(zip(*columns))
+
+    # Uma célula só precisa de Paragraph quando o texto não cabe numa linha da coluna
+    # (ex.: Designações longas, ou Ord. com 3+ dígitos que o Paragraph quebra em duas linhas)
+    cell_padding = 6 # LEFTPADDING/RIGHTPADDING por omissão das células
+    text_widths = [w - 2 * cell_padding for w in col_widths]
+
+    def make_cell(text, width, style):
+        if stringWidth(text, 'Helvetica', 7) <= width:
+            return text
+        if ' ' not in text:
+            # Palavra única (ex.: Ord.): parte por caracteres como o Paragraph faria
+            return _split_long_word(text, width)
+        return Paragraph(text, style)
+
+    for start in range(0, max(len(rows), 1), FAST_MODE_CHUNK_ROWS):
+        data = [header_row] if start == 0 else []
+        style_cmds = list(base_style_cmds)
+        if start == 0:
+            style_cmds += header_style_cmds
+
+        for ord_val, cod_val, des_val, val_rob, stk_sif, stk_rob, val_sif, err_val in rows[start:start + FAST_MODE_CHUNK_ROWS]:
+            is_error = bool(err_val) and err_val.strip() != ""
+            if is_error:
+                style_cmds.append(('TEXTCOLOR', (0, len(data)), (-1, len(data)), colors.red))
+            row_style = error_cell_style if is_error else cell_style
+            values = (ord_val, cod_val, des_val, val_rob, stk_sif, stk_rob, val_sif, err_val)
+            data.append([make_cell(v, w, row_style) for v, w in zip(values, text_widths)])
+
+        if not data:
+            break
+        table = Table(data, colWidths=col_widths)
+        table.setStyle(TableStyle(style_cmds))
+        elements.append(table)
+    
+    # Rodapé simples
+    elements.append(Spacer(1, 1*cm))
+    footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8)
+    now_str = datetime.now().strftime('%d-%m-%Y %H:%M:%S')
+    elements.append(Paragraph(f"Impressão: {now_str}", footer_style))
+    
+    _track_progress(doc, progress)
     doc.build(elements)
     buffer.seek(0)
-    return buffer
\ No newline at end of file
+    return buffer, doc.page
@@ -1,94 +1,612 @@
+import hashlib
+import os
 import re
+import zlib
 import pandas as pd
 import sys
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
 
-def process_pdf_to_dataframe(pdf_path):
+from instrumentation import stage, count
+
+# Bump when the extracted rows change, so cached parses are invalidated
+PARSER_VERSION = 1
+
+PDF_COLUMNS = ['Ord.', 'Código', 'Designação', 'Stock', 'Validade']
+
+# Text extraction engine used when none is given (see BACKENDS)
+DEFAULT_BACKEND = 'pdfplumber'
+
+# Layout mode: the table band starts below the line holding TABLE_HEADER and ends at the
+# first line below it holding one of FOOTER_MARKERS (located once, on the first page)
+TABLE_HEADER = "ord. código"
+FOOTER_MARKERS = ("impressão:", "página")
+# Lines of the band that do not match line_regex are description continuations when they
+# start at least this many points right of the table's left edge (the Ord. column)
+CONTINUATION_INDENT = 20
+# Text segments whose vertical centres are this close (points) belong to the same line
+LINE_TOLERANCE = 3
+
+# Printed dates (and times), like the "Impressão: 15-01-2026 15:04" footer, are masked before
+# hashing a page's content, so re-exported pages that did not change keep their cache keys.
+# Row validities are MM-YYYY and never match.
+_PRINT_STAMP = re.compile(rb'\d{2}-\d{2}-\d{4}(?:\s+\d{2}:\d{2}(?::\d{2})?)?')
+
+# Regex to capture the main data line.
+# Logic: The Code is ALWAYS the last 7 digits of the initial number block.
+# The rest (prefix) is the Order Number (Ord).
+# This handles both "1 5323951" (space) and "15323951" (merged) correctly.
+
+# ^(\d+?) matches Ord (lazy, consumes minimum needed)
+# \s* matches optional space
+# (\d{7}) matches Code (strict 7 digits)
+# \s+ matches space separator before Description
+line_regex = re.compile(r'^(\d+?)\s*(\d{7})\s+(.*?)LOTE\s+[^0-9]+?\s+(\d+)\s+[A-Z\.]+\s+(\d{2}-\d{4})')
+
+def _is_header_line(line):
+    """Heuristics to recognise page headers/footers of the Sifarma report."""
+    lower = line.lower()
+    if "farmacia" in lower or "nif:" in lower or "telefone:" in lower:
+        return True
+    if "lista de controlo" in lower or "expiram entre" in lower:
+        return True
+    if "ord. código" in lower or "lotedesignação" in lower:
+        return True
+    if "impressão:" in lower or "página" in lower:
+        return True
+    return False
+
+def _parse_page_text(text):
+    """
+    Parses the text of a single page.
+
+    Returns:
+        tuple: (orphans, rows) where `rows` are the entries starting on this page and
+               `orphans` are description continuation lines found before the first entry,
+               which belong to the last entry of the previous page.
+    """
+    orphans = []
+    rows = []
+    current_entry = None
+
+    if not text:
+        return orphans, rows
+
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        
+        match = line_regex.search(line)
+        
+        if match:
+            # New Entry Found
+            current_entry = _entry(match)
+            rows.append(current_entry)
+        elif not _is_header_line(line):
+            # Not a main data line: continuation of the description of the current entry,
+            # or of the previous page's last entry if no entry started on this page yet.
+            if current_entry:
+                current_entry["Designação"] += " " + line
+            else:
+                orphans.append(line)
+
+    return orphans, rows
+
+def _entry(match):
+    """Row record of a line_regex match."""
+    return {
+        "Ord.": int(match.group(1)),
+        "Código": match.group(2),
+        "Designação": match.group(3).strip(),
+        "Stock": int(match.group(4)),
+        "Validade": match.group(5)
+    }
+
+def _parse_page_lines(lines, left):
+    """
+    Layout mode counterpart of _parse_page_text, for the lines of a page's table band.
+
+    Every line is inside the table, so no header/footer filtering is needed: a line is an
+    entry if it matches line_regex, a description continuation if it is indented past
+    the Ord. column (`left` + CONTINUATION_INDENT), and is ignored otherwise.
+
+    Args:
+        lines (list): (x0, top, bottom, text) tuples, top to bottom.
+        left (float): x of the table's left edge.
+
+    Returns:
+        tuple: (orphans, rows), as _parse_page_text.
+    """
+    orphans = []
+    rows = []
+    current_entry = None
+    for x0, _, _, text in lines:
+        text = text.strip()
+        if not text:
+            continue
+        match = line_regex.search(text)
+        if match:
+            current_entry = _entry(match)
+            rows.append(current_entry)
+        elif x0 >= left + CONTINUATION_INDENT:
+            if current_entry:
+                current_entry["Designação"] += " " + text
+            else:
+                orphans.append(text)
+    return orphans, rows
+
+def _find_table_band(lines):
+    """
+    Locates the table on a page from its lines (x0, top, bottom, text).
+
+    Returns:
+        tuple | None: (top, bottom, left) of the table band, in points from the page top,
+                      or None if the page has no table header.
+    """
+    header = next((line for line in lines if TABLE_HEADER in line[3].lower()), None)
+    if header is None:
+        return None
+    footer_tops = [
+        top for _, top, _, text in lines
+        if top > header[2] and any(marker in text.lower() for marker in FOOTER_MARKERS)
+        and not line_regex.search(text.strip())
+    ]
+    return header[2], min(footer_tops, default=float('inf')), header[0]
+
+def _group_lines(segments):
+    """
+    Groups text segments (top, bottom, x0, x1) on the same baseline into line boxes
+    (x0, top, bottom, x1), top to bottom.
+    """
+    groups = []
+    for top, bottom, x0, x1 in sorted(segments):
+        middle = (top + bottom) / 2
+        if groups and abs(middle - groups[-1][0]) <= LINE_TOLERANCE:
+            groups[-1][1].append((top, bottom, x0, x1))
+        else:
+            groups.append((middle, [(top, bottom, x0, x1)]))
+
+    return [
+        (min(part[2] for part in parts), min(part[0] for part in parts),
+         max(part[1] for part in parts), max(part[3] for part in parts))
+        for _, parts in groups
+    ]
+
+def _stitch_pages(page_results):
+    """
+    Yields entries in page order, attaching orphan lines to the preceding entry.
+
+    The last entry seen is held back until the next entry starts, since the
+    following page may still carry continuation lines of its description.
+    """
+    pending = None
+    for orphans, rows in page_results:
+        if orphans and pending:
+            pending["Designação"] += " " + " ".join(orphans)
+        if rows:
+            if pending:
+                yield pending
+            yield from rows[:-1]
+            pending = rows[-1]
+    if pending:
+        yield pending
+
+class _PdfplumberDocument:
+    """
+    Text of each page from pdfplumber's extract_text: full character layout (positions,
+    fonts) computed in pure Python, then grouped into lines.
+    """
+
+    def __init__(self, source):
+        try:
+            import pdfplumber
+        except ImportError:
+            raise ImportError("The 'pdfplumber' library is required. Please install it with: pip install pdfplumber")
+        self._pdf = pdfplumber.open(_open_source(source))
+
+    def __len__(self):
+        return len(self._pdf.pages)
+
+    def page_text(self, i):
+        """Extracts the text of page `i` and releases the page's cached layout objects."""
+        page = self._pdf.pages[i]
+        try:
+            return page.extract_text()
+        finally:
+            page.close()
+
+    def page_lines(self, i, band=None):
+        """Lines (x0, top, bottom, text) of page `i`, only those inside `band` (top, bottom, ...) if given."""
+        page = self._pdf.pages[i]
+        try:
+            if band is not None:
+                page = page.within_bbox((0, band[0], page.width, min(band[1], page.height)))
+            return [(line['x0'], line['top'], line['bottom'], line['text'])
+                    for line in page.extract_text_lines(return_chars=False)]
+        finally:
+            self._pdf.pages[i].close()
+
+    def page_digests(self):
+        """
+        Content digests of the pages (see page_keys), from pdfminer's page objects of this
+        document; the decoded streams are kept and reused when the text is extracted.
+        """
+        return [_content_digest(page.page_obj, lambda stream: stream.get_data()) for page in self._pdf.pages]
+
+    def close(self):
+        self._pdf.close()
+
+class _PdfiumDocument:
+    """
+    Text of each page from PDFium's text page (native code, via pypdfium2), which yields
+    the same lines as pdfplumber for the Sifarma report without building a Python object
+    per character.
+    """
+
+    def __init__(self, source):
+        try:
+            import pypdfium2
+        except ImportError:
+            raise ImportError("The 'pypdfium2' library is required for the 'pdfium' backend. Please install it with: pip install pypdfium2")
+        self._pdf = pypdfium2.PdfDocument(_open_source(source))
+
+    def __len__(self):
+        return len(self._pdf)
+
+    def page_text(self, i):
+        page = self._pdf[i]
+        textpage = page.get_textpage()
+        try:
+            # PDFium ends lines with CRLF
+            return textpage.get_text_range().replace('\r\n', '\n')
+        finally:
+            textpage.close()
+            page.close()
+
+    def page_lines(self, i, band=None):
+        """
+        Lines (x0, top, bottom, text) of page `i`: PDFium's text segments inside `band`
+        (top, bottom, ...) if given, grouped into line boxes, with the text of the region.
+        """
+        page = self._pdf[i]
+        textpage = page.get_textpage()
+        try:
+            height = page.get_height()
+            segments = []
+            for j in range(textpage.count_rects()):
+                left, bottom, right, top = textpage.get_rect(j)
+                # Same convention as pdfplumber: distances from the top of the page
+                from_top, to_bottom = height - top, height - bottom
+                if band is not None and (from_top < band[0] or to_bottom > band[1]):
+                    continue
+                segments.append((from_top, to_bottom, left, right))
+
+            boxes = _group_lines(segments)
+            if not boxes:
+                return []
+            # One call for the whole region (each call scans every character of the page);
+            # its lines pair up with the boxes unless PDFium splits a line differently
+            texts = textpage.get_text_bounded(
+                min(box[0] for box in boxes), height - max(box[2] for box in boxes),
+                max(box[3] for box in boxes), height - min(box[1] for box in boxes)
+            ).split('\r\n')
+            if len(texts) != len(boxes):
+                texts = [textpage.get_text_bounded(x0, height - bottom, x1, height - top).replace('\r\n', ' ')
+                         for x0, top, bottom, x1 in boxes]
+            return [(x0, top, bottom, text) for (x0, top, bottom, _), text in zip(boxes, texts)]
+        finally:
+            textpage.close()
+            page.close()
+
+    def page_digests(self):
+        """PDFium does not expose the content streams: page_keys reads them with pdfminer."""
+        return None
+
+    def close(self):
+        self._pdf.close()
+
+# Available text extraction engines, by name. Each opens a path, bytes or binary buffer and
+# exposes len(), page_text(i), page_lines(i, band) and page_digests(); all of them must give the same rows.
+BACKENDS = {
+    'pdfplumber': _PdfplumberDocument,
+    'pdfium': _PdfiumDocument,
+}
+
+def _open_document(source, backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown PDF backend {backend!r}; expected one of {sorted(BACKENDS)}")
+    return BACKENDS[backend](source)
+
+def _open_source(source):
+    """Wraps raw bytes in a buffer; paths and file-like objects are passed through."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return BytesIO(source)
+    return source
+
+def _picklable_source(source):
+    """Returns a path or bytes that can be sent to worker processes."""
+    if isinstance(source, (str, os.PathLike, bytes)):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    source.seek(0)
+    return source.read()
+
+def _parse_page(document, i, band=None):
+    """(orphans, rows) of page `i`: from its whole text, or from the lines of the table band."""
+    if band is None:
+        return _parse_page_text(document.page_text(i))
+    return _parse_page_lines(document.page_lines(i, band), band[2])
+
+def _extract_pages(source, pages, backend=DEFAULT_BACKEND, band=None):
+    """Worker: parses the given pages and returns one (orphans, rows) tuple per page."""
+    document = _open_document(source, backend)
+    try:
+        return [_parse_page(document, i, band) for i in pages]
+    finally:
+        document.close()
+
+def _a85decode(data):
+    """ASCII85 decoding of a whole stream at once (base64.a85decode loops in Python per group)."""
+    import numpy as np
+
+    data = re.sub(rb'\s+', b'', data)
+    if data.startswith(b'<~'):
+        data = data[2:]
+    data = data.split(b'~>')[0].replace(b'z', b'!!!!!')
+    pad = -len(data) % 5
+    digits = np.frombuffer(data + b'u' * pad, dtype=np.uint8).reshape(-1, 5).astype(np.uint64) - 33
+    words = digits @ (np.uint64(85) ** np.arange(4, -1, -1, dtype=np.uint64))
+    decoded = words.astype('>u4').tobytes()
+    return decoded[:len(decoded) - pad]
+
+def _stream_data(stream):
+    """
+    Decoded bytes of a content stream. ASCII85 + Flate streams (as written by reportlab)
+    are decoded here, since pdfminer's ASCII85 decoding dominates the cost of page_keys.
+    """
+    from pdfminer.pdftypes import LITERALS_ASCII85_DECODE, LITERALS_FLATE_DECODE
+
+    filters = [f for f, _ in stream.get_filters()]
+    if stream.decipher is None and len(filters) == 2 and filters[0] in LITERALS_ASCII85_DECODE \
+            and filters[1] in LITERALS_FLATE_DECODE and not stream.get_filters()[1][1]:
+        try:
+            return zlib.decompress(_a85decode(stream.rawdata))
+        except (ValueError, zlib.error):
+            pass
+    return stream.get_data()
+
+def _font_data(resources, decode):
+    """
+    Bytes of the page's fonts that decide its text: resource name, type, base font (without
+    the subset tag, which changes between exports), encoding, CID ordering and the
+    decoded ToUnicode map. With subset fonts the same glyph codes can stand for other
+    text in another document, so the content stream alone does not identify the page.
+    """
+    from pdfminer.pdftypes import PDFStream, resolve1
+
+    fonts = resolve1((resources or {}).get('Font')) or {}
+    for name in sorted(fonts):
+        font = resolve1(fonts[name])
+        if not isinstance(font, dict):
+            continue
+        base_font = re.sub(r'^[A-Z]{6}\+', '', str(getattr(resolve1(font.get('BaseFont')), 'name', '')))
+        encoding = resolve1(font.get('Encoding'))
+        if isinstance(encoding, dict):
+            encoding = {key: resolve1(value) for key, value in encoding.items()}
+        cid_info = [resolve1(resolve1(descendant).get('CIDSystemInfo'))
+                    for descendant in resolve1(font.get('DescendantFonts')) or []]
+        yield f"{name}|{font.get('Subtype')}|{base_font}|{encoding!r}|{cid_info!r}".encode('utf-8')
+
+        to_unicode = resolve1(font.get('ToUnicode'))
+        if isinstance(to_unicode, PDFStream):
+            yield decode(to_unicode)
+
+def _content_digest(page, decode):
+    """
+    SHA-256 of a (pdfminer) page's decoded content streams, with printed dates masked,
+    and of the fonts they are drawn with.
+    """
+    from pdfminer.pdftypes import resolve1
+
+    digest = hashlib.sha256()
+    for content in page.contents:
+        digest.update(_PRINT_STAMP.sub(b'#', decode(resolve1(content))))
+    for data in _font_data(page.resources, decode):
+        digest.update(b'\0')
+        digest.update(data)
+    return digest.hexdigest()
+
+def _key_suffix(backend, band):
+    mode = 'texto' if band is None else 'faixa-' + '-'.join(f"{v:.1f}" for v in band)
+    return f"v{PARSER_VERSION}-{backend}-{mode}"
+
+def extraction_tag(backend=DEFAULT_BACKEND, layout=False):
+    """
+    Names the extraction settings in file-level cache keys (e.g. 'pdfium-faixa'): backends
+    and modes may give different rows for the same file, so they must not share entries.
+    """
+    return f"{backend}-{'faixa' if layout else 'texto'}"
+
+def page_keys(source, backend=DEFAULT_BACKEND, band=None):
+    """
+    Cache keys of the pages of a PDF (see page_cache.PageCache): the SHA-256 of each
+    page's decoded content stream, with printed dates masked, and of its fonts (including
+    their ToUnicode maps), plus the parser version,
+    backend and table band, since those also decide the rows.
+
+    Only the PDF structure is read (with pdfminer), no text is extracted.
+
+    Returns:
+        list: One key per page.
+    """
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfparser import PDFParser
+
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return page_keys(f.read(), backend, band)
+    stream = _open_source(source)
+    stream.seek(0)
+
+    suffix = _key_suffix(backend, band)
+    return [f"{_content_digest(page, _stream_data)}-{suffix}"
+            for page in PDFPage.create_pages(PDFDocument(PDFParser(stream)))]
+
+def _document_page_keys(document, source, backend, band):
+    """
+    page_keys through the already-open document when its backend reaches the content
+    streams (pdfplumber), so the PDF structure is not parsed a second time.
+    """
+    digests = document.page_digests()
+    if digests is None:
+        return page_keys(source, backend, band)
+    suffix = _key_suffix(backend, band)
+    return [f"{digest}-{suffix}" for digest in digests]
+
+def _page_ranges(n_pages, n_ranges):
+    """Splits n_pages into n_ranges contiguous (start, stop) ranges of similar size."""
+    step, extra = divmod(n_pages, n_ranges)
+    ranges = []
+    start = 0
+    for i in range(n_ranges):
+        stop = start + step + (1 if i < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+def _iter_page_results(source, workers, backend=DEFAULT_BACKEND, layout=False, page_cache=None):
+    """
+    Yields (orphans, rows) per page, sequentially or from a pool of page-range workers.
+    Pages found in `page_cache` are not extracted again; the others are added to it.
+    """
+    document = _open_document(source, backend)
+    try:
+        n_pages = len(document)
+        band = None
+        if layout and n_pages:
+            band = _find_table_band(document.page_lines(0))
+            if band is None:
+                print("Warning: Table header not found on the first page; parsing the whole page text.")
+
+        keys = None
+        if page_cache is not None:
+            keys = _document_page_keys(document, source, backend, band)
+            if len(keys) != n_pages:
+                keys = None
+        cached = [page_cache.get(key) for key in keys] if keys else [None] * n_pages
+        missing = [i for i in range(n_pages) if cached[i] is None]
+        if keys:
+            count('pages_cached', n_pages - len(missing))
+
+        workers = min(workers, len(missing))
+        if workers <= 1:
+            for i in range(n_pages):
+                count('pages')
+                page_result = cached[i]
+                if page_result is None:
+                    page_result = _parse_page(document, i, band)
+                    if keys:
+                        page_cache.put(keys[i], page_result)
+                yield page_result
+            return
+        chunks = [missing[start:stop] for start, stop in _page_ranges(len(missing), workers)]
+    finally:
+        document.close()
+
+    source = _picklable_source(source)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_extract_pages, source, chunk, backend, band) for chunk in chunks]
+        # Results of the extracted pages, in page order (the chunks are contiguous runs of `missing`)
+        extracted = (page_result for future in futures for page_result in future.result())
+        for i in range(n_pages):
+            count('pages')
+            page_result = cached[i]
+            if page_result is None:
+                page_result = next(extracted)
+                if keys:
+                    page_cache.put(keys[i], page_result)
+            yield page_result
+
+def iter_pdf_rows(source, workers=1, backend=DEFAULT_BACKEND, layout=False, page_cache=None):
+    """
+    Streams the stock validation rows of a PDF file, one record at a time.
+
+    Only the current page is held in memory in sequential mode; each page's
+    layout objects are released as soon as its text is extracted.
+    
+    Args:
+        source (str | bytes | file-like): Path to the PDF file, its raw bytes or a binary buffer.
+        workers (int): Number of worker processes for text extraction. 1 (default) parses
+                       sequentially; None uses one worker per CPU. Each worker parses a
+                       contiguous page range and the rows are merged back in page order.
+        backend (str): Text extraction engine, a key of BACKENDS ('pdfplumber' or 'pdfium').
+        layout (bool): Locates the table band (below the 'Ord. Código' header row, above
+                       the footer) once, on the first page, and reads only that region of
+                       every page, telling description continuations apart by their
+                       indentation instead of filtering header/footer lines by keyword.
+                       Assumes every page repeats the first page's header layout.
+                       Slower than text mode on both backends (every character of the
+                       page is still read before the band is cropped, and the line
+                       positions cost more than the running text): it changes how
+                       lines are classified, not how much is parsed.
+        page_cache (PageCache): Parsed pages of earlier files, by content hash. Only the
+                                pages not found there are extracted; the rows are still
+                                stitched across every page, in page order.
+
+    Yields:
+        dict: Record with keys 'Ord.', 'Código', 'Designação', 'Stock', 'Validade'.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    yield from _stitch_pages(_iter_page_results(source, workers, backend, layout, page_cache))
+
+def iter_pdf_batches(source, batch_size=1000, workers=1, backend=DEFAULT_BACKEND, layout=False, page_cache=None):
+    """
+    Streams the rows of a PDF file as DataFrames of at most `batch_size` rows.
+
+    Returns:
+        Iterator[pd.DataFrame]: Batches with the same columns as process_pdf_to_dataframe,
+                                with 'Ord.' as a regular column.
+    """
+    batch = []
+    for row in iter_pdf_rows(source, workers=workers, backend=backend, layout=layout, page_cache=page_cache):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield pd.DataFrame(batch, columns=PDF_COLUMNS)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch, columns=PDF_COLUMNS)
+
+def process_pdf_to_dataframe(source, workers=1, backend=DEFAULT_BACKEND, layout=False, page_cache=None):
     """
     Reads a PDF file and extracts the stock validation table into a pandas DataFrame.
     
     Args:
-        pdf_path (str): Path to the PDF file.
+        source (str | bytes | file-like): Path to the PDF file, its raw bytes or a binary buffer.
+        workers (int): Number of worker processes for text extraction (see iter_pdf_rows).
+        backend (str): Text extraction engine (see iter_pdf_rows).
+        layout (bool): Reads only the table band of each page (see iter_pdf_rows).
+        page_cache (PageCache): Skips the pages already parsed (see iter_pdf_rows).
         
     Returns:
         pd.DataFrame: DataFrame with columns ['Ord.', 'Código', 'Designação', 'Stock', 'Validade'],
                       indexed by 'Ord.'.
     """
-    try:
-        import pdfplumber
-    except ImportError:
-        raise ImportError("The 'pdfplumber' library is required. Please install it with: pip install pdfplumber")
+    with stage('pdf_parse', workers=workers, backend=backend, layout=layout) as record:
+        data = list(iter_pdf_rows(source, workers=workers, backend=backend, layout=layout, page_cache=page_cache))
 
-    data = []
-    current_entry = None
-    
-    # Regex to capture the main data line.
-    # Logic: The Code is ALWAYS the last 7 digits of the initial number block.
-    # The rest (prefix) is the Order Number (Ord).
-    # This handles both "1 5323951" (space) and "15323951" (merged) correctly.
-    
-    # ^(\d+?) matches Ord (lazy, consumes minimum needed)
-    # \s* matches optional space
-    # (\d{7}) matches Code (strict 7 digits)
-    # \s+ matches space separator before Description
-    line_regex = re.compile(r'^(\d+?)\s*(\d{7})\s+(.*?)LOTE\s+[^0-9]+?\s+(\d+)\s+[A-Z\.]+\s+(\d{2}-\d{4})')
-
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text()
-            if not text:
-                continue
-                
-            lines = text.split('\n')
-            
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                
-                match = line_regex.search(line)
-                
-                if match:
-                    # New Entry Found
-                    ord_val = match.group(1)
-                    code_val = match.group(2)
-                    desc_part = match.group(3).strip()
-                    stock = match.group(4)
-                    validade = match.group(5)
-                    
-                    current_entry = {
-                        "Ord.": int(ord_val),
-                        "Código": code_val,
-                        "Designação": desc_part,
-                        "Stock": int(stock),
-                        "Validade": validade
-                    }
-                    data.append(current_entry)
-                else:
-                    # Not a main data line. 
-                    # Check if it's a continuation of the description for the current entry.
-                    # We must ignore headers/footers.
-                    
-                    # Heuristics to ignore headers/footers
-                    lower = line.lower()
-                    if "farmacia" in lower or "nif:" in lower or "telefone:" in lower:
-                        continue
-                    if "lista de controlo" in lower or "expiram entre" in lower:
-                        continue
-                    if "ord. código" in lower or "lotedesignação" in lower:
-                        continue
-                    if "impressão:" in lower or "página" in lower:
-                        continue
-                    
-                    # If we have an active entry, append this text to its description
-                    if current_entry:
-                        current_entry["Designação"] += " " + line
-
-    if not data:
-        print("Warning: No data extracted.")
-        return pd.DataFrame(columns=['Ord.', 'Código', 'Designação', 'Stock', 'Validade'])
-
-    df = pd.DataFrame(data)
-    df.set_index('Ord.', inplace=True)
+        if not data:
+            print("Warning: No data extracted.")
+            df = pd.DataFrame(columns=PDF_COLUMNS)
+        else:
+            df = pd.DataFrame(data)
+            df.set_index('Ord.', inplace=True)
+
+        record['rows_out'] = len(df)
     return df
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+import pandas as pd
+
+from csv_processor import process_csv_files_to_dataframe, process_csv_to_dataframe
+from data_merger import RobotIndex, merge_stock_data
+from pdf_processor import DEFAULT_BACKEND, process_pdf_to_dataframe
+
+
+class InputError(ValueError):
+    """Raised when an input file cannot be read as a Sifarma PDF or robot CSV."""
+
+
+def read_sifarma_pdf(source, workers=1, backend=DEFAULT_BACKEND, layout=False, page_cache=None):
+    """
+    Parses the Sifarma list (see process_pdf_to_dataframe) with 'Ord.' as a column.
+    """
+    df = process_pdf_to_dataframe(source, workers=workers, backend=backend, layout=layout, page_cache=page_cache)
+    # Reset index to ensure 'Ord.' is available as a column if it was index
+    if df.index.name == 'Ord.':
+        df = df.reset_index()
+    return df
+
+
+def read_robot_csvs(sources, chunksize=None, workers=None):
+    """
+    Aggregates one robot CSV, or several exports of the same store combined
+    (see process_csv_files_to_dataframe).
+    """
+    if len(sources) == 1:
+        return process_csv_to_dataframe(sources[0], chunksize=chunksize)
+    return process_csv_files_to_dataframe(sources, chunksize=chunksize, workers=workers)
+
+
+def reconcile(df_pdf, robot):
+    """
+    Merged analysis of a parsed list against the robot data (a DataFrame or RobotIndex),
+    in the original PDF order.
+    """
+    final_df = merge_stock_data(df_pdf, robot)
+    # Sort by Ord. if available to maintain original order
+    if 'Ord.' in final_df.columns:
+        final_df['Ord.'] = pd.to_numeric(final_df['Ord.'], errors='coerce')
+        final_df = final_df.sort_values('Ord.')
+    return final_df
+
+
+def _read_input(kind, read, *args, **kwargs):
+    """Runs a reader, turning its failures into InputError (the file, not the code, is at fault)."""
+    try:
+        return read(*args, **kwargs)
+    except MemoryError:
+        raise
+    except Exception as e:
+        raise InputError(f"Could not read the {kind} file: {type(e).__name__}: {e}") from None
+
+
+def reconcile_files(pdf_source, csv_sources, backend=DEFAULT_BACKEND, layout=False, csv_workers=None):
+    """
+    Full reconciliation of one store: parses the Sifarma PDF and the robot CSV(s) and
+    merges them.
+
+    Args:
+        pdf_source (str | bytes | file-like): Sifarma list.
+        csv_sources (list): Robot exports (paths, bytes or buffers).
+        backend (str): PDF text extraction engine (see pdf_processor.BACKENDS).
+        layout (bool): Classify the PDF lines inside the table band (see pdf_processor.iter_pdf_rows).
+        csv_workers (int): Processes reading several CSVs (see process_csv_files_to_dataframe).
+
+    Returns:
+        tuple: (parsed PDF, robot aggregate, its RobotIndex, merged analysis in PDF order).
+
+    Raises:
+        InputError: When a file cannot be parsed.
+    """
+    df_pdf = _read_input('pdf', read_sifarma_pdf, pdf_source, backend=backend, layout=layout)
+    df_csv = _read_input('csv', read_robot_csvs, csv_sources, workers=csv_workers)
+    robot_index = RobotIndex(df_csv)
+    return df_pdf, df_csv, robot_index, reconcile(df_pdf, robot_index)
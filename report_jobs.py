@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import collect
+
+
+class ReportJob:
+    """
+    A report file generated in the background. `progress` goes from 0 to 1, and
+    `records` holds the stage records measured while generating it (see
+    instrumentation.collect), since the pool thread has no collector of the caller.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.submitted = time.time()
+        self.progress = 0.0
+        self.records = []
+        self.future = None
+
+    @property
+    def done(self):
+        return self.future.done()
+
+    @property
+    def failed(self):
+        return self.future.done() and self.future.exception() is not None
+
+    def result(self, timeout=None):
+        """Bytes of the report, waiting for them if needed (raises the generation error, if any)."""
+        return self.future.result(timeout)
+
+    def _set_progress(self, fraction):
+        self.progress = max(self.progress, min(float(fraction), 1.0))
+
+
+class ReportJobs:
+    """
+    Generates report files (PDF, Excel) in a small pool of background threads, so the
+    Streamlit script only submits the work and polls its progress instead of blocking
+    the session while the file is built.
+
+    Jobs are keyed by the content of what they report (e.g. the analysis key and the
+    format). Submitting a key that is running or finished returns the existing job, so
+    sessions looking at the same analysis share one generation and a finished file is
+    served again without being rebuilt. The `max_finished` most recently used finished
+    jobs are kept; a failed job is replaced when its key is submitted again.
+    """
+
+    def __init__(self, max_workers=2, max_finished=8):
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The job of `key`, or None if it was never submitted (or was dropped)."""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                self._jobs.move_to_end(key)
+            return job
+
+    def submit(self, key, generate):
+        """
+        Starts `generate(progress)` in the pool unless `key` is already running or done.
+
+        Args:
+            key (str): Identity of the report.
+            generate (callable): Receives a progress callback (fraction from 0 to 1) and
+                                 returns the report bytes.
+
+        Returns:
+            ReportJob: The new or existing job.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not job.failed:
+                self._jobs.move_to_end(key)
+                return job
+            job = ReportJob(key)
+            job.future = self._executor.submit(self._generate, job, generate)
+            self._jobs[key] = job
+            self._jobs.move_to_end(key)
+            self._prune()
+            return job
+
+    @staticmethod
+    def _generate(job, generate):
+        with collect() as records:
+            try:
+                return generate(job._set_progress)
+            finally:
+                job.records = records
+
+    def _prune(self):
+        finished = [key for key, job in self._jobs.items() if job.done]
+        for key in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[key]
@@ -0,0 +1,125 @@
+import threading
+from collections import OrderedDict
+
+
+def frame_nbytes(df):
+    """Bytes held by a DataFrame, strings included (the size charged to the store budget)."""
+    if isinstance(df, bytes):
+        return len(df)
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class ResultStore:
+    """
+    Process-wide store of DataFrames (parsed inputs, merged results) keyed by content hashes.
+    Rendered files (bytes) can be stored too, charged by their length.
+
+    Entries are evicted least-recently-used first once their total size exceeds
+    `max_bytes` or their number exceeds `max_entries`. An entry larger than the whole
+    budget is not stored. All methods are safe to call from several threads, as
+    Streamlit runs each session's script in its own thread.
+
+    Stored DataFrames are shared between callers and must not be modified in place.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, max_entries=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        # One lock per key being computed, so concurrent sessions compute it only once
+        self._computing = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key):
+        """Returns the DataFrame stored under `key` (counting a hit or a miss), or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, df):
+        """Stores `df` under `key`, evicting older entries to stay within the budget."""
+        nbytes = frame_nbytes(df)
+        with self._lock:
+            self._discard(key)
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                return
+            self._entries[key] = (df, nbytes)
+            self.nbytes += nbytes
+            while self._over_budget():
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the DataFrame stored under `key`, calling `compute()` only on a miss.
+        If several threads miss the same key at once, only one of them computes it.
+        """
+        df = self.get(key)
+        if df is not None:
+            return df
+
+        with self._lock:
+            key_lock = self._computing.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                with self._lock:
+                    entry = self._entries.get(key)
+                if entry is not None:
+                    return entry[0]
+                df = compute()
+                self.put(key, df)
+                return df
+        finally:
+            with self._lock:
+                self._computing.pop(key, None)
+
+    def clear(self):
+        """Removes every entry (the counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: entries, bytes, max_bytes, hits, misses, evictions and hit_rate.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+
+    def _over_budget(self):
+        if self.max_bytes is not None and self.nbytes > self.max_bytes:
+            return True
+        return self.max_entries is not None and len(self._entries) > self.max_entries
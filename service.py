@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from email import policy
+from email.parser import BytesParser
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from compact_frames import compact_frame, expand_frame
+from csv_processor import PARSER_VERSION as CSV_PARSER_VERSION
+from instrumentation import collect, configure_logging, stage
+from parse_cache import ParseCache
+from pdf_exporter import generate_pdf
+from pdf_processor import (BACKENDS as PDF_BACKENDS, DEFAULT_BACKEND as PDF_DEFAULT_BACKEND, extraction_tag,
+                           PARSER_VERSION as PDF_PARSER_VERSION)
+from pipeline import InputError, reconcile_files
+from result_store import ResultStore
+
+FORMATS = {
+    'json': 'application/json; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+    'pdf': 'application/pdf',
+}
+# Latest measurements kept per stage for the /metrics percentiles
+LATENCY_WINDOW = 1000
+
+
+class QueueFull(Exception):
+    """Raised when every worker is busy and the waiting queue is at its limit."""
+
+
+def _reconcile(pdf_data, csv_datas, merged, out_format, pdf_backend=PDF_DEFAULT_BACKEND, pdf_layout=False):
+    """
+    Worker: parses and merges the files (unless the compact `merged` analysis is given)
+    and renders it in `out_format`.
+
+    Returns:
+        tuple: (compact merged analysis, response bytes, stage records).
+    """
+    with collect() as records:
+        if merged is None:
+            # Parse failures come back as InputError, answered 422 (the client's file, not a server fault)
+            *_, final_df = reconcile_files(pdf_data, csv_datas, backend=pdf_backend, layout=pdf_layout, csv_workers=1)
+            merged = compact_frame(final_df)
+        else:
+            final_df = expand_frame(merged)
+
+        with stage('service_render', rows_in=len(final_df), format=out_format) as record:
+            if out_format == 'pdf':
+                body = generate_pdf(final_df).getvalue()
+            elif out_format == 'parquet':
+                buffer = BytesIO()
+                final_df.to_parquet(buffer, index=False)
+                body = buffer.getvalue()
+            else:
+                body = final_df.to_json(orient='records', force_ascii=False).encode('utf-8')
+            record['rows_out'] = len(final_df)
+    return merged, body, records
+
+
+def _parse_multipart(content_type, body):
+    """
+    Files of a multipart/form-data body, by field name.
+
+    Returns:
+        dict: Field name -> list of the uploaded contents (bytes), in body order.
+    """
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode('latin1') + b"\r\n\r\n" + body)
+    if not message.is_multipart():
+        raise InputError("Expected a multipart/form-data body")
+    files = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if name:
+            files.setdefault(name, []).append(part.get_payload(decode=True) or b"")
+    return files
+
+
+class ReconcileService:
+    """
+    Reconciliations for the HTTP service: a bounded process pool, a result cache and
+    the counters shown by /metrics.
+
+    At most `workers + queue_size` jobs are accepted at once; beyond that submit()
+    raises QueueFull, so a burst of requests is refused early instead of piling up.
+    Responses are cached by the content hash of the files (and the format), and the
+    merged analysis is cached too, so asking for another format of the same files
+    does not parse them again. Identical requests arriving together run only once.
+    """
+
+    def __init__(self, workers=None, queue_size=8, cache_mb=256, pdf_backend=PDF_DEFAULT_BACKEND, pdf_layout=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.pdf_backend = pdf_backend
+        self.pdf_layout = pdf_layout
+        self.store = ResultStore(max_bytes=cache_mb * 1024 * 1024)
+        self.started = time.time()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.rejected = 0
+        self.responses = Counter()
+        self._stage_counts = Counter()
+        self._latencies = {}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def reconcile(self, pdf_data, csv_datas, out_format):
+        """
+        Response bytes of one reconciliation, from the cache or from the pool.
+
+        Raises:
+            QueueFull: When the job cannot be queued.
+            InputError: When a file cannot be parsed.
+        """
+        csv_keys = sorted(ParseCache.make_key('csv', data, CSV_PARSER_VERSION) for data in csv_datas)
+        pdf_key = ParseCache.make_key(f"pdf-{extraction_tag(self.pdf_backend, self.pdf_layout)}", pdf_data, PDF_PARSER_VERSION)
+        merge_key = f"merge-{pdf_key}-{'-'.join(csv_keys)}"
+
+        def compute():
+            merged = self.store.get(merge_key)
+            job = (None, None) if merged is not None else (pdf_data, csv_datas)
+            merged, body, records = self._run(*job, merged, out_format)
+            self.store.put(merge_key, merged)
+            self.record_stages(records)
+            return body
+
+        return self.store.get_or_compute(f"{out_format}-{merge_key}", compute)
+
+    def _run(self, pdf_data, csv_datas, merged, out_format):
+        with self._lock:
+            if self._pending >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise QueueFull()
+            self._pending += 1
+        try:
+            future = self._executor.submit(_reconcile, pdf_data, csv_datas, merged, out_format,
+                                           self.pdf_backend, self.pdf_layout)
+            return future.result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def record_stages(self, records):
+        with self._lock:
+            for record in records:
+                self._stage_counts[record['stage']] += 1
+                self._latencies.setdefault(record['stage'], deque(maxlen=LATENCY_WINDOW)).append(record['wall_s'])
+
+    def record_response(self, status):
+        with self._lock:
+            self.responses[int(status)] += 1
+
+    def metrics(self):
+        """
+        Returns:
+            dict: Pool and queue state, response counts, cache statistics and, per stage,
+                  the run count and latency (mean, p50, p95, max) of the latest runs.
+        """
+        with self._lock:
+            stages = {
+                name: {
+                    'count': self._stage_counts[name],
+                    'mean_s': round(float(np.mean(values)), 6),
+                    'p50_s': round(float(np.percentile(values, 50)), 6),
+                    'p95_s': round(float(np.percentile(values, 95)), 6),
+                    'max_s': round(float(np.max(values)), 6),
+                }
+                for name, values in self._latencies.items()
+            }
+            return {
+                'uptime_s': round(time.time() - self.started, 1),
+                'workers': self.workers,
+                'queue_limit': self.queue_size,
+                'in_flight': self._pending,
+                'queue_depth': max(self._pending - self.workers, 0),
+                'rejected': self.rejected,
+                'responses': {str(status): n for status, n in sorted(self.responses.items())},
+                'cache': self.store.stats(),
+                'stages': stages,
+            }
+
+
+class ReconcileHandler(BaseHTTPRequestHandler):
+    """
+    POST /reconcile?format=json|parquet|pdf with a multipart/form-data body holding one
+    'pdf' file (Sifarma list) and one or more 'csv' files (robot exports);
+    GET /metrics and GET /health.
+    """
+
+    server_version = "RobotValidades"
+    # Largest request body accepted (bytes)
+    max_body = 200 * 1024 * 1024
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send_json(HTTPStatus.OK, {'status': 'ok', 'in_flight': self.service.metrics()['in_flight']})
+        elif path == '/metrics':
+            self._send_json(HTTPStatus.OK, self.service.metrics())
+        elif path == '/reconcile':
+            self._send_error(HTTPStatus.METHOD_NOT_ALLOWED, "Use POST")
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, "Unknown path")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/reconcile':
+            self._send_error(HTTPStatus.NOT_FOUND, "Unknown path")
+            return
+
+        out_format = parse_qs(url.query).get('format', ['json'])[0]
+        if out_format not in FORMATS:
+            self._send_error(HTTPStatus.BAD_REQUEST, f"Unknown format '{out_format}' (expected one of {sorted(FORMATS)})")
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > self.max_body:
+            self._send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Body larger than {self.max_body} bytes")
+            return
+
+        start = time.perf_counter()
+        try:
+            files = _parse_multipart(self.headers.get('Content-Type', ''), self.rfile.read(length))
+            if len(files.get('pdf', [])) != 1 or not files.get('csv'):
+                raise InputError("Expected one 'pdf' file and at least one 'csv' file")
+            body = self.service.reconcile(files['pdf'][0], files['csv'], out_format)
+        except QueueFull:
+            self._send_error(HTTPStatus.SERVICE_UNAVAILABLE, "Too many reconciliations in progress, retry later",
+                             {'Retry-After': '5'})
+            return
+        except InputError as e:
+            self._send_error(HTTPStatus.UNPROCESSABLE_ENTITY, str(e))
+            return
+        except Exception as e:
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, f"{type(e).__name__}: {e}")
+            return
+        self.service.record_stages([{'stage': 'service_request', 'wall_s': time.perf_counter() - start}])
+        self._send(HTTPStatus.OK, body, FORMATS[out_format])
+
+    def _send(self, status, body, content_type, headers=None):
+        self.service.record_response(status)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload, headers=None):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'), FORMATS['json'], headers)
+
+    def _send_error(self, status, message, headers=None):
+        self._send_json(status, {'error': message}, headers)
+
+
+def make_server(host, port, service):
+    """ThreadingHTTPServer answering with ReconcileHandler; each request runs in its own thread."""
+    server = ThreadingHTTPServer((host, port), ReconcileHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP service reconciling Sifarma PDF / robot CSV files.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8502, help="Port (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--queue", type=int, default=8, help="Requests waiting for a worker before answering 503 (default: %(default)s)")
+    parser.add_argument("--cache-mb", type=int, default=256, help="Memory for cached results (default: %(default)s)")
+    parser.add_argument("--pdf-backend", choices=sorted(PDF_BACKENDS), default=PDF_DEFAULT_BACKEND,
+                        help="PDF text extraction engine (default: %(default)s)")
+    parser.add_argument("--pdf-layout", action="store_true", help="Classify PDF lines by position in the table band (slower than the default text mode)")
+    args = parser.parse_args()
+
+    configure_logging()
+    service = ReconcileService(workers=args.workers, queue_size=args.queue, cache_mb=args.cache_mb,
+                               pdf_backend=args.pdf_backend, pdf_layout=args.pdf_layout)
+    server = make_server(args.host, args.port, service)
+    print(f"Listening on http://{args.host}:{args.port} with {service.workers} worker(s)...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
@@ -0,0 +1,210 @@
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from compact_frames import compact_frame, expand_frame
+from data_merger import RobotIndex
+
+# Snapshots kept per store; older runs are deleted when a new one is saved
+DEFAULT_KEEP = 7
+
+CHANGE_NEW = "novo"
+CHANGE_REMOVED = "removido"
+CHANGE_STOCK = "stock"
+CHANGE_VALIDITY = "validade"
+CHANGE_BOTH = "stock e validade"
+CHANGE_CATEGORIES = [CHANGE_NEW, CHANGE_REMOVED, CHANGE_STOCK, CHANGE_VALIDITY, CHANGE_BOTH]
+
+_FRAMES = ('pdf', 'csv', 'merged')
+
+
+class SnapshotStore:
+    """
+    Keeps a compact Parquet snapshot (parsed PDF, parsed CSV, merged analysis) of each
+    reconciliation run, per store, so the next run can be compared with it.
+
+    Layout: `<directory>/<store>/<run id>/{pdf,csv,merged}.parquet` plus `meta.json`
+    with the run time and the parse keys of the two files.
+    """
+
+    def __init__(self, directory, keep=DEFAULT_KEEP):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("The 'pyarrow' library is required for run snapshots. Please install it with: pip install pyarrow")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def _store_dir(self, store):
+        # Store names come from users; keep them to a safe directory name
+        return os.path.join(self.directory, re.sub(r'[^\w.-]+', '_', store).strip('._') or 'loja')
+
+    def runs(self, store):
+        """Metadata of the saved runs of `store`, oldest first."""
+        store_dir = self._store_dir(store)
+        if not os.path.isdir(store_dir):
+            return []
+        runs = []
+        for run_id in sorted(os.listdir(store_dir)):
+            meta_path = os.path.join(store_dir, run_id, 'meta.json')
+            if os.path.exists(meta_path):
+                with open(meta_path, encoding='utf-8') as f:
+                    runs.append(json.load(f))
+        return runs
+
+    def previous(self, store, pdf_key, csv_key):
+        """Metadata of the latest run of `store` on other files than (pdf_key, csv_key), or None."""
+        for meta in reversed(self.runs(store)):
+            if (meta['pdf_key'], meta['csv_key']) != (pdf_key, csv_key):
+                return meta
+        return None
+
+    def load(self, store, run_id):
+        """
+        Returns:
+            dict: 'pdf', 'csv' and 'merged' DataFrames of the run, expanded to the usual layout.
+        """
+        run_dir = os.path.join(self._store_dir(store), run_id)
+        return {name: expand_frame(pd.read_parquet(os.path.join(run_dir, f"{name}.parquet"))) for name in _FRAMES}
+
+    def save(self, store, pdf_key, csv_key, df_pdf, df_csv, merged):
+        """
+        Saves a run unless the latest snapshot of `store` already has the same files.
+
+        Returns:
+            dict: Metadata of the saved (or already saved) run.
+        """
+        with self._lock:
+            runs = self.runs(store)
+            if runs and (runs[-1]['pdf_key'], runs[-1]['csv_key']) == (pdf_key, csv_key):
+                return runs[-1]
+
+            now = datetime.now()
+            meta = {
+                'run_id': now.strftime('%Y%m%d-%H%M%S-%f'),
+                'created': now.isoformat(timespec='seconds'),
+                'store': store,
+                'pdf_key': pdf_key,
+                'csv_key': csv_key,
+                'rows': len(merged),
+            }
+            store_dir = self._store_dir(store)
+            # Written under a temporary name and renamed, so a half-written run is never listed
+            tmp_dir = os.path.join(store_dir, f".{meta['run_id']}.tmp")
+            os.makedirs(tmp_dir, exist_ok=True)
+            for name, df in zip(_FRAMES, (df_pdf, df_csv, merged)):
+                compact_frame(df).to_parquet(os.path.join(tmp_dir, f"{name}.parquet"))
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, indent=2)
+            os.replace(tmp_dir, os.path.join(store_dir, meta['run_id']))
+
+            for old in runs[:max(len(runs) + 1 - self.keep, 0)]:
+                shutil.rmtree(os.path.join(store_dir, old['run_id']), ignore_errors=True)
+            return meta
+
+
+def _per_code(values, codes):
+    """
+    One value per code: the value itself for codes on a single line, the tuple of the
+    line values (in list order) for codes on several lines.
+    """
+    values = pd.Series(values.to_numpy(dtype=object), index=codes.to_numpy())
+    repeated = values.index.duplicated(keep=False)
+    single = values[~repeated]
+    if not repeated.any():
+        return single
+    multi = values[repeated].groupby(level=0, sort=False).agg(tuple)
+    return pd.concat([single, multi])
+
+
+def _code_state(df_pdf, df_csv):
+    """Per-code Sifarma lines and robot values that decide the merged rows of the code."""
+    codes = df_pdf['Código'].astype(str).str.strip()
+    robot = df_csv if isinstance(df_csv, RobotIndex) else RobotIndex(df_csv)
+    listed = pd.Index(codes.unique())
+    positions = robot.positions(listed)
+
+    state = pd.DataFrame(index=listed)
+    state['stock'] = _per_code(df_pdf['Stock'], codes)
+    state['validade'] = _per_code(df_pdf['Validade'], codes)
+    state['stock_robot'] = robot.stock(positions)
+    state['validade_robot'] = pd.Series(robot.validity_at(positions), index=listed).astype(object)
+    return state
+
+
+def _differs(previous, current):
+    """Element-wise inequality of two object Series, treating missing values as equal."""
+    both_missing = previous.isna().to_numpy() & current.isna().to_numpy()
+    return (previous.to_numpy(dtype=object) != current.to_numpy(dtype=object)) & ~both_missing
+
+
+def compute_delta(previous, df_pdf, df_csv):
+    """
+    Compares a run with the previous one, per Sifarma code.
+
+    A code is 'novo' / 'removido' when it entered / left the Sifarma list. Otherwise it
+    changed in 'stock' when its Sifarma line stocks or robot units differ, and in
+    'validade' when its Sifarma or robot validities differ ('stock e validade' if both).
+
+    Args:
+        previous (dict): Frames of the previous run (SnapshotStore.load).
+        df_pdf (pd.DataFrame): Current parsed PDF (with 'Ord.' as a column).
+        df_csv (pd.DataFrame | RobotIndex): Current robot data.
+
+    Returns:
+        pd.DataFrame: One line per changed code, indexed by code, with the categorical
+                      column 'Alteração'.
+    """
+    before = _code_state(previous['pdf'], previous['csv'])
+    after = _code_state(df_pdf, df_csv)
+
+    common = after.index.intersection(before.index)
+    b, a = before.loc[common], after.loc[common]
+    stock_changed = _differs(b['stock'], a['stock']) | _differs(b['stock_robot'], a['stock_robot'])
+    validity_changed = _differs(b['validade'], a['validade']) | _differs(b['validade_robot'], a['validade_robot'])
+
+    changed = np.select(
+        [stock_changed & validity_changed, stock_changed, validity_changed],
+        [CHANGE_BOTH, CHANGE_STOCK, CHANGE_VALIDITY],
+        default=''
+    )
+    parts = [
+        pd.Series(CHANGE_NEW, index=after.index.difference(before.index)),
+        pd.Series(CHANGE_REMOVED, index=before.index.difference(after.index)),
+        pd.Series(changed, index=common)[changed != ''],
+    ]
+    delta = pd.concat(parts).astype(pd.CategoricalDtype(CHANGE_CATEGORIES))
+    return delta.rename_axis('Codigo').rename('Alteração').to_frame()
+
+
+def changed_rows(delta, merged, previous_merged):
+    """
+    Rows to review since the previous run, each with its 'Alteração'.
+
+    The rows of new or changed codes are taken from the current analysis, which is
+    already merged; removed codes are shown with their rows from the previous analysis.
+
+    Args:
+        delta (pd.DataFrame): Output of compute_delta.
+        merged (pd.DataFrame): Merged analysis of the current run (merge_stock_data).
+        previous_merged (pd.DataFrame): Merged analysis of the previous run.
+
+    Returns:
+        pd.DataFrame: 'Alteração' followed by the merge_stock_data columns.
+    """
+    current = merged[merged['Codigo'].astype(str).str.strip().isin(delta.index).to_numpy()]
+    current = current.join(delta, on='Codigo')
+
+    removed_codes = delta.index[delta['Alteração'] == CHANGE_REMOVED]
+    removed = previous_merged[previous_merged['Codigo'].isin(removed_codes)].join(delta, on='Codigo')
+
+    rows = pd.concat([current, removed], ignore_index=True)
+    return rows[['Alteração'] + [c for c in rows.columns if c != 'Alteração']]
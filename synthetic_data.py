@@ -0,0 +1,190 @@
+import random
+from datetime import date
+from io import BytesIO
+
+import pandas as pd
+
+# Column x positions (points) of the Sifarma "Lista de Controlo de Prazos de Validades" layout
+_COLUMNS_X = {
+    'ord': 28,
+    'code': 46,
+    'desc': 92,
+    'lote': 318,
+    'stock': 428,
+    'pratel': 455,
+    'validade': 500,
+}
+_PAGE_TOP = 800
+_ROW_HEIGHT = 11
+_PAGE_BOTTOM = 60
+
+_PRODUCT_WORDS = [
+    'BEN-U-RON', 'BRUFEN', 'AMOXICILINA', 'OMEPRAZOL', 'PARACETAMOL', 'IBUPROFENO',
+    'ATORVASTATINA', 'METFORMINA', 'SINVASTATINA', 'LOSARTAN', 'BISOPROLOL', 'PANTOPRAZOL',
+]
+_FORMS = ['COMP', 'CAPS', 'XAROPE', 'SAQUETAS', 'COMP REV', 'SOL ORAL', 'POMADA']
+_LOTES = ['DESCONHECIDO', 'SEM LOTE', 'N/D']
+_PRATELEIRAS = ['ROBOT', 'GAV.A', 'GAV.B', 'FRIO', 'ARM.']
+
+def generate_items(n_items, seed=0):
+    """
+    Generates the Sifarma list items.
+
+    Returns:
+        pd.DataFrame: Columns ['Ord.', 'Código', 'Designação', 'Stock', 'Validade'] as the PDF
+                      parser should extract them (wrapped descriptions already joined).
+    """
+    rnd = random.Random(seed)
+    codes = rnd.sample(range(1_000_000, 10_000_000), n_items)
+    items = []
+    for i, code in enumerate(codes, start=1):
+        name = f"{rnd.choice(_PRODUCT_WORDS)} {rnd.choice([100, 200, 250, 400, 500, 1000])}MG {rnd.choice(_FORMS)}"
+        # About one description in six wraps onto a second line
+        if rnd.random() < 1 / 6:
+            name += f" X {rnd.choice([20, 30, 60, 90])} UNIDADES BLISTER PVC ALU"
+        items.append({
+            'Ord.': i,
+            'Código': str(code),
+            'Designação': name,
+            'Stock': rnd.randint(0, 12),
+            'Validade': f"{rnd.randint(1, 12):02d}-{rnd.randint(2025, 2027)}",
+        })
+    return pd.DataFrame(items)
+
+def _split_description(text, max_chars=38):
+    """Splits a description into the first line and the wrapped remainder (if any)."""
+    if len(text) <= max_chars:
+        return text, None
+    cut = text.rfind(' ', 0, max_chars)
+    return text[:cut], text[cut + 1:]
+
+def generate_sifarma_pdf(items, seed=0):
+    """
+    Renders items as a Sifarma "Lista de Controlo de Prazos de Validades" PDF, in the layout
+    line_regex expects: page header, one line per item, some Ord./CNP pairs printed merged
+    ("15323951"), long descriptions wrapped onto the next line (sometimes across a page
+    break) and a footer with the page number.
+
+    Args:
+        items (pd.DataFrame): Output of generate_items.
+        seed (int): Random seed for the layout choices.
+
+    Returns:
+        bytes: PDF content.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    rnd = random.Random(seed)
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    state = {'page': 0, 'y': 0}
+
+    def start_page():
+        state['page'] += 1
+        pdf.setFont('Helvetica', 8)
+        y = _PAGE_TOP
+        pdf.drawString(28, y, "Farmacia Central Lda.   NIF: 501234567   Telefone: 210000000")
+        y -= 14
+        pdf.setFont('Helvetica-Bold', 11)
+        pdf.drawString(28, y, "Lista de Controlo de Prazos de Validades")
+        y -= 13
+        pdf.setFont('Helvetica', 8)
+        pdf.drawString(28, y, "Produtos que expiram entre 01-2025 e 12-2027")
+        y -= 16
+        pdf.setFont('Helvetica-Bold', 8)
+        pdf.drawString(_COLUMNS_X['ord'], y, "Ord. Código")
+        pdf.drawString(_COLUMNS_X['lote'] - 238, y, "LoteDesignação")
+        pdf.drawString(_COLUMNS_X['stock'], y, "Stock")
+        pdf.drawString(_COLUMNS_X['pratel'], y, "Pratel.")
+        pdf.drawString(_COLUMNS_X['validade'], y, "Validade")
+        pdf.drawString(545, y, "Correcção")
+        pdf.setFont('Helvetica', 8)
+        state['y'] = y - 14
+
+    def end_page():
+        pdf.drawString(28, 30, f"Impressão: {date(2026, 1, 15).strftime('%d-%m-%Y')} 15:04")
+        pdf.drawString(500, 30, f"Página {state['page']}")
+        pdf.showPage()
+
+    def next_line():
+        state['y'] -= _ROW_HEIGHT
+        if state['y'] < _PAGE_BOTTOM:
+            end_page()
+            start_page()
+
+    start_page()
+    for row in items.itertuples(index=False):
+        ord_val, code, desc, stock, validade = row
+        first, rest = _split_description(desc)
+        y = state['y']
+
+        if rnd.random() < 0.2:
+            # Ord. and CNP printed without a gap, as in some Sifarma exports
+            pdf.drawString(_COLUMNS_X['ord'], y, f"{ord_val}{code}")
+        else:
+            pdf.drawString(_COLUMNS_X['ord'], y, str(ord_val))
+            pdf.drawString(_COLUMNS_X['code'], y, code)
+        pdf.drawString(_COLUMNS_X['desc'], y, first)
+        pdf.drawString(_COLUMNS_X['lote'], y, f"LOTE {rnd.choice(_LOTES)}")
+        pdf.drawString(_COLUMNS_X['stock'], y, str(stock))
+        pdf.drawString(_COLUMNS_X['pratel'], y, rnd.choice(_PRATELEIRAS))
+        pdf.drawString(_COLUMNS_X['validade'], y, validade)
+        next_line()
+
+        if rest:
+            pdf.drawString(_COLUMNS_X['desc'], state['y'], rest)
+            next_line()
+
+    end_page()
+    pdf.save()
+    return buffer.getvalue()
+
+def generate_robot_csv(items, seed=0, mismatch_rate=0.3, missing_rate=0.05, extra_codes=0.1):
+    """
+    Generates a robot "Manutenção de stock" CSV export (latin1, ';'-separated, one row per unit).
+
+    Args:
+        items (pd.DataFrame): Output of generate_items.
+        seed (int): Random seed.
+        mismatch_rate (float): Fraction of items whose robot stock differs by ±1.
+        missing_rate (float): Fraction of items absent from the robot.
+        extra_codes (float): Robot-only barcodes, as a fraction of the item count.
+
+    Returns:
+        bytes: CSV content.
+    """
+    rnd = random.Random(seed)
+    lines = ["Ord.;Código de barras;Unidade;Dosagem;Armazenado em;Data de validade;Nome do artigo"]
+    unit = 0
+
+    def add_units(code, count, month, year):
+        nonlocal unit
+        for _ in range(count):
+            unit += 1
+            day = rnd.randint(1, 28)
+            lines.append(f"{unit};{code};{unit};1;Robot 1;{day:02d}/{month:02d}/{year};Artigo {code}")
+
+    for row in items.itertuples(index=False):
+        if rnd.random() < missing_rate:
+            continue
+        stock = row.Stock
+        if rnd.random() < mismatch_rate:
+            stock = max(stock + rnd.choice([-1, 1]), 0)
+        month, year = (int(part) for part in row.Validade.split('-'))
+        add_units(row.Código, stock, month, year)
+
+    for code in rnd.sample(range(10_000_000, 99_999_999), int(len(items) * extra_codes)):
+        add_units(str(code), rnd.randint(1, 5), rnd.randint(1, 12), rnd.randint(2025, 2027))
+
+    return ("\n".join(lines) + "\n").encode('latin1')
+
+def generate_dataset(n_items, seed=0):
+    """
+    Generates a matching Sifarma PDF and robot CSV.
+
+    Returns:
+        tuple: (items DataFrame, PDF bytes, CSV bytes).
+    """
+    items = generate_items(n_items, seed=seed)
+    return items, generate_sifarma_pdf(items, seed=seed), generate_robot_csv(items, seed=seed)